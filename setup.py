@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 
-from distutils.core import setup
+try:
+    from setuptools import setup
+except ImportError:
+    from distutils.core import setup
 
 setup(name='simgit',
       version='0.1',
@@ -8,5 +11,6 @@ setup(name='simgit',
       author='Carl Baldwin',
       author_email='carl@ecbaldwin.net',
       url='http://github.com/ecbaldwin/simgit',
-      packages=['simgit'],
+      packages=['simgit', 'simgit.bench'],
+      entry_points={'console_scripts': ['simgit = simgit.cli:main']},
      )
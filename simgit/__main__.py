@@ -0,0 +1,5 @@
+import sys
+
+from simgit.cli import main
+
+sys.exit(main())
@@ -0,0 +1,198 @@
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import platform
+import random
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Peaks per call need the peak to be reset before each.
+_peaks = hasattr(tracemalloc, "reset_peak")
+
+from simgit import repository
+
+
+class Timings(object):
+    """ Adds up the calls, seconds and peak memory of named operations.
+
+    The peak is only taken while tracemalloc is tracing. It is the highest
+    any single call went above what was allocated when it started. That
+    needs tracemalloc.reset_peak, new in python 3.9; before, the peak
+    would be the highest since tracing started, so it is left as None.
+    """
+    def __init__(self):
+        self._results = collections.OrderedDict()
+
+    def call(self, name, function, *args, **kwargs):
+        """ Call function with args, adding it up under name. """
+        tracing = _peaks and tracemalloc.is_tracing()
+        if tracing:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            seconds = time.time() - start
+            result = self._results.get(name)
+            if result is None:
+                result = self._results[name] = collections.OrderedDict(
+                    [("calls", 0), ("seconds", 0.0), ("peak_bytes", None)])
+            result["calls"] += 1
+            result["seconds"] += seconds
+            if tracing:
+                peak = tracemalloc.get_traced_memory()[1] - before
+                result["peak_bytes"] = max(result["peak_bytes"] or 0, peak)
+
+    @property
+    def results(self):
+        return self._results
+
+
+def _color(n):
+    # Spread the branch colours around so lanes are easy to tell apart.
+    rng = random.Random(n)
+    return "#%02x%02x%02x" % tuple(rng.randrange(64, 224) for _ in range(3))
+
+
+# The topics take turns at these. A squash replaces every commit it passes
+# over, master's too, so a topic is replayed onto master before squashing.
+# Otherwise master would have two revisions of its own changes once it
+# merged the squash, and replaying over that is refused.
+_REWRITES = ["rebase", "replay", "replay_squash", "fixup_replay"]
+
+
+def generate(commits=1000, branches=10, rounds=10, fan_in=2, seed=0, timings=None):
+    """ Make a synthetic history to benchmark with, the same for the same seed.
+
+    The commits go at random to master and branches topic-0 and on, in
+    rounds + 1 goes. Between goes each topic is rewritten onto master and
+    master merges fan_in of them. Operations are counted in timings.
+    """
+    if timings is None:
+        timings = Timings()
+    rng = random.Random(seed)
+    repo = repository.Repository()
+    master = repo.branch("master", color="#808080")
+    timings.call("commit", master.commit, "Initial commit")
+    topics = [master.branch("topic-%d" % n, color=_color(n)) for n in range(branches)]
+
+    count = 1
+    for go in range(rounds + 1):
+        share = (commits - count) // (rounds + 1 - go)
+        for _ in range(share):
+            branch = rng.choice([master] + topics)
+            timings.call("commit", branch.commit, "Change %d on %s" % (count, branch.name))
+            count += 1
+        if go == rounds:
+            break
+
+        for number, topic in enumerate(topics):
+            operation = _REWRITES[number % len(_REWRITES)]
+            if operation == "rebase":
+                timings.call("rebase", topic.rebase, master)
+            elif operation == "replay":
+                timings.call("replay", topic.replay, master)
+            elif operation == "replay_squash":
+                timings.call("replay", topic.replay, master)
+                timings.call("replay_squash", topic.replay_squash, master,
+                             "Squashed %s" % topic.name)
+            else:
+                mine = list(repository.dfs_visit_range(master, topic))
+                if not mine:
+                    mine = [timings.call("commit", topic.commit, "Work on %s" % topic.name)]
+                fixup = timings.call("commit", topic.commit, "Fixup on %s" % topic.name)
+                timings.call("fixup_replay", topic.fixup_replay, mine[0], {fixup: mine[0]})
+
+        ahead = [t for t in topics if not repository.is_ancestor(t, master)]
+        if ahead:
+            timings.call("merge", master.merge, rng.sample(ahead, min(fan_in, len(ahead))))
+    return repo
+
+
+class _Discard(object):
+    def write(self, text):
+        pass
+
+
+def _measure(parameters, timings):
+    repo = generate(timings=timings, **parameters)
+    timings.call("dfs_visit", lambda: sum(1 for _ in repo.dfs_visit(
+        visit_ancestors=True, visit_replaces=True)))
+    layout = timings.call("place", repo.place)
+    timings.call("render", repo.render, out=_Discard(), layout=layout)
+    timings.call("render_compact", repo.render, out=_Discard(), layout=layout, compact=True)
+    return repo, layout
+
+
+def run(commits=1000, branches=10, rounds=10, fan_in=2, seed=0, memory=True):
+    """ Benchmark a synthetic history and return the results for json.
+
+    Times are taken on a run of their own. With memory, and tracemalloc
+    around with reset_peak, the history is made again under tracemalloc
+    for the peaks, so tracing doesn't slow down the times. Otherwise the
+    peaks are None, as unavailable.
+    """
+    parameters = collections.OrderedDict([
+        ("commits", commits), ("branches", branches), ("rounds", rounds),
+        ("fan_in", fan_in), ("seed", seed)])
+    timings = Timings()
+    repo, layout = _measure(parameters, timings)
+    results = timings.results
+
+    if memory and _peaks:
+        traced = Timings()
+        tracemalloc.start()
+        try:
+            _measure(parameters, traced)
+        finally:
+            tracemalloc.stop()
+        for name, result in traced.results.items():
+            results[name]["peak_bytes"] = result["peak_bytes"]
+
+    return collections.OrderedDict([
+        ("parameters", parameters),
+        ("python", platform.python_version()),
+        ("numpy", repository.numpy is not None),
+        ("history", collections.OrderedDict([
+            ("commits", repo.ids.count),
+            ("placed", len(layout.commits)),
+            ("width", layout.width),
+            ("lanes", layout.height)])),
+        ("results", results),
+    ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m simgit.bench",
+        description="Time simgit on a synthetic history and write the results as json.")
+    parser.add_argument("--commits", type=int, default=1000)
+    parser.add_argument("--branches", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--fan-in", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the second run taking memory peaks")
+    parser.add_argument("-o", "--output", help="write to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    results = run(commits=args.commits,
+                  branches=args.branches,
+                  rounds=args.rounds,
+                  fan_in=args.fan_in,
+                  seed=args.seed,
+                  memory=not args.no_memory)
+    text = json.dumps(results, indent=2) + "\n"
+    if args.output:
+        with open(args.output, "w") as out:
+            out.write(text)
+    else:
+        sys.stdout.write(text)
@@ -0,0 +1,3 @@
+from simgit.bench import main
+
+main()
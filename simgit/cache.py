@@ -0,0 +1,63 @@
+import os
+import tempfile
+
+# Replaces an existing file in one go, where python 2 has to make do.
+_replace = getattr(os, "replace", os.rename)
+
+
+class RenderCache(object):
+    """ Rendered histories kept on disk, see Repository.render_cache.
+
+    Each render is a file in directory named by its key. Getting one
+    touches it, and putting one in drops those least recently touched
+    beyond size. Files are written aside and renamed into place, so any
+    number of processes can share a cache.
+    """
+    def __init__(self, directory, size=256):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._directory = directory
+        self._size = size
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def _path(self, key):
+        return os.path.join(self._directory, key + ".svg")
+
+    def get(self, key):
+        """ The bytes put in under key, or None. """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+        return data
+
+    def put(self, key, data):
+        fd, written = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as out:
+            out.write(data)
+        _replace(written, self._path(key))
+        self._evict()
+
+    def _evict(self):
+        renders = []
+        for name in os.listdir(self._directory):
+            if name.endswith(".svg"):
+                path = os.path.join(self._directory, name)
+                try:
+                    renders.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass
+        if len(renders) <= self._size:
+            return
+        renders.sort()
+        for _, path in renders[:len(renders) - self._size]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
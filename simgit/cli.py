@@ -0,0 +1,198 @@
+from __future__ import print_function
+
+import argparse
+import fnmatch
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import runpy
+import sys
+import tempfile
+import traceback
+
+# Loaded once here for every script to share, the modules scripts import
+# themselves are dropped after each.
+import simgit.repository
+
+MANIFEST = ".simgit-manifest.json"
+
+# Replaces an existing file in one go, where python 2 has to make do.
+_replace = getattr(os, "replace", os.rename)
+
+
+def _sha1(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def version_digest():
+    """ A digest of simgit's own source, which any output depends on. """
+    package = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha1()
+    for directory, subdirectories, files in sorted(os.walk(package)):
+        subdirectories.sort()
+        for name in sorted(files):
+            if name.endswith(".py"):
+                path = os.path.join(directory, name)
+                digest.update(os.path.relpath(path, package).encode("utf-8"))
+                digest.update(_sha1(path).encode("ascii"))
+    return digest.hexdigest()
+
+
+def _write(path, data):
+    # Written aside and renamed into place, so a file is never half done.
+    fd, written = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    with os.fdopen(fd, "wb") as out:
+        out.write(data)
+    _replace(written, path)
+
+
+def _scripts(paths, pattern, exclude):
+    # The scripts, each with the name of its svg, which has to be its own.
+    scripts = []
+    for path in paths:
+        if os.path.isdir(path):
+            scripts.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                           if fnmatch.fnmatch(name, pattern) and name not in exclude)
+        else:
+            scripts.append(path)
+    named = []
+    names = {}
+    for script in scripts:
+        name = os.path.splitext(os.path.basename(script))[0] + ".svg"
+        other = names.setdefault(name, script)
+        if other != script:
+            raise Exception("%s and %s would both be rendered to %s" % (other, script, name))
+        named.append((script, name))
+    return named
+
+
+def _run_script(task):
+    """ Run a scenario script as __main__, writing what it prints to output.
+
+    Returns (script, error), error being None if it went well. Modules
+    the script imported that weren't imported before are forgotten after,
+    so helpers next to one script are never taken for another's.
+    """
+    script, output = task
+    script = os.path.abspath(script)
+    captured = io.BytesIO() if str is bytes else io.StringIO()
+    saved = sys.stdout, sys.argv, list(sys.path)
+    modules = set(sys.modules)
+    sys.stdout = captured
+    sys.argv = [script]
+    sys.path.insert(0, os.path.dirname(script))
+    try:
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            return script, "exited with %s" % e.code
+    except Exception:
+        return script, traceback.format_exc().rstrip().splitlines()[-1]
+    finally:
+        sys.stdout, sys.argv, sys.path[:] = saved
+        for name in set(sys.modules) - modules:
+            del sys.modules[name]
+    data = captured.getvalue()
+    if not data.strip():
+        return script, "printed nothing"
+    _write(output, data if isinstance(data, bytes) else data.encode("utf-8"))
+    return script, None
+
+
+def render_all(paths, output, jobs=None, pattern="*.py", exclude=("setup.py",),
+               force=False, out=None):
+    """ Run the scenario scripts in paths, writing each one's svg to output.
+
+    paths are scripts, or directories of them matching pattern. Unless
+    force, a script is skipped if neither it nor simgit changed since it
+    last went well. The rest run on jobs processes. Returns how many failed.
+    """
+    if out is None:
+        out = sys.stderr
+    if not os.path.isdir(output):
+        os.makedirs(output)
+    manifest_path = os.path.join(output, MANIFEST)
+    manifest = {}
+    if not force and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    version = version_digest()
+
+    tasks = []
+    sources = {}
+    skipped = 0
+    for script, name in _scripts(paths, pattern, exclude):
+        svg = os.path.join(output, name)
+        source = sources[os.path.abspath(script)] = _sha1(script)
+        entry = manifest.get(name)
+        if (entry is not None and entry.get("source") == source
+                and entry.get("simgit") == version and os.path.exists(svg)):
+            skipped += 1
+            continue
+        tasks.append((script, svg))
+
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        try:
+            results = pool.map(_run_script, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_run_script(task) for task in tasks]
+
+    failed = 0
+    for (script, svg), (_, error) in zip(tasks, results):
+        name = os.path.basename(svg)
+        if error is None:
+            manifest[name] = {"script": script,
+                              "source": sources[os.path.abspath(script)],
+                              "simgit": version}
+            print("rendered %s" % svg, file=out)
+        else:
+            manifest.pop(name, None)
+            failed += 1
+            print("failed %s: %s" % (script, error), file=out)
+    manifest = json.dumps(manifest, indent=2, sort_keys=True) + "\n"
+    _write(manifest_path, manifest.encode("utf-8"))
+    print("%d rendered, %d unchanged, %d failed" % (len(tasks) - failed, skipped, failed),
+          file=out)
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="simgit",
+        description="Tools for simgit histories.")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+    render = commands.add_parser(
+        "render-all",
+        help="run scenario scripts and write the svg each prints to a file",
+        description="Run scenario scripts in parallel, writing the svg each prints "
+                    "to a file. Scripts unchanged since the last run, and with "
+                    "simgit unchanged, are skipped.")
+    render.add_argument("paths", nargs="+", metavar="path",
+                        help="a script, or a directory of them")
+    render.add_argument("-o", "--output", default=".", help="where the svgs go")
+    render.add_argument("-j", "--jobs", type=int,
+                        help="processes to run, one per cpu by default")
+    render.add_argument("--pattern", default="*.py",
+                        help="the scripts to run in a directory, *.py by default")
+    render.add_argument("--exclude", action="append", default=None,
+                        help="a file name to leave out, setup.py by default")
+    render.add_argument("-f", "--force", action="store_true",
+                        help="run every script, changed or not")
+    args = parser.parse_args(argv)
+
+    failed = render_all(args.paths, args.output,
+                        jobs=args.jobs,
+                        pattern=args.pattern,
+                        exclude=tuple(args.exclude or ("setup.py",)),
+                        force=args.force)
+    return 1 if failed else 0
@@ -0,0 +1,211 @@
+from __future__ import print_function
+
+import collections
+import itertools
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+from simgit.repository import Repository
+from simgit.stats import Stats
+
+try:
+    _string_types = (str, unicode)
+except NameError:
+    _string_types = (str,)
+
+
+class Step(object):
+    """ A Branch method called on a branch, looked up by name when applied.
+
+    Step("topic", "replay", "master") replays topic onto master. "name~n"
+    is the commit n first parents back from the head of name.
+    """
+    def __init__(self, branch, operation, *args):
+        self._branch = branch
+        self._operation = operation
+        self._args = args
+
+    @property
+    def label(self):
+        return "%s.%s(%s)" % (self._branch, self._operation,
+                              ", ".join(_label(a) for a in self._args))
+
+    def __repr__(self):
+        return "<Step %s>" % self.label
+
+    def apply(self, repository):
+        branches = repository.branches
+        branch = branches.get(self._branch)
+        if branch is None:
+            raise Exception("There's no branch %s" % self._branch)
+        method = getattr(branch, self._operation)
+        return method(*[_resolve(branches, a) for a in self._args])
+
+
+def _label(arg):
+    if isinstance(arg, dict):
+        return "{%s}" % ", ".join("%s: %s" % (_label(k), _label(v))
+                                  for k, v in sorted(arg.items()))
+    if isinstance(arg, (list, tuple)):
+        return "[%s]" % ", ".join(_label(a) for a in arg)
+    return str(arg)
+
+
+def _resolve(branches, arg):
+    if isinstance(arg, _string_types):
+        if arg in branches:
+            return branches[arg]
+        name, tilde, back = arg.rpartition("~")
+        if tilde and name in branches and back.isdigit():
+            commit = branches[name].head
+            for _ in range(int(back)):
+                commit = commit.parents[0]
+            return commit
+        return arg
+    if isinstance(arg, dict):
+        return dict((_resolve(branches, k).commitish(), _resolve(branches, v).commitish())
+                    for k, v in arg.items())
+    if isinstance(arg, (list, tuple)):
+        return type(arg)(_resolve(branches, a) for a in arg)
+    return arg
+
+
+# One end state, which the orderings all came to. state is its
+# Repository.state_hash, the same for histories alike bar their sha1s.
+# An ordering that raised has the error instead, and ends at that step.
+Outcome = collections.namedtuple(
+    "Outcome", ["state", "orderings", "error", "replay_merges", "commits", "width", "lanes"])
+
+
+def _walk(state, steps, done, merges, length, found):
+    # Every ordering through done, forking at each step so the steps before
+    # are only ever taken once.
+    if len(done) == length:
+        layout = state.place()
+        found.append(Outcome(state.state_hash, done, None, merges,
+                             len(layout.commits), layout.width, layout.height))
+        return
+    for number, step in enumerate(steps):
+        if number in done:
+            continue
+        fork = state.fork()
+        fork.stats = Stats()
+        ordering = done + (number,)
+        try:
+            step.apply(fork)
+        except Exception as e:
+            found.append(Outcome(None, ordering, str(e), None, None, None, None))
+            continue
+        _walk(fork, steps, ordering, merges + fork.stats.counters["commits.replay_merge"],
+              length, found)
+
+
+def _explore(base, steps, prefix, length):
+    # The orderings starting with prefix, which is taken on one fork.
+    state = base.fork()
+    state.stats = Stats()
+    for taken, number in enumerate(prefix):
+        try:
+            steps[number].apply(state)
+        except Exception as e:
+            return [Outcome(None, prefix[:taken + 1], str(e), None, None, None, None)]
+    merges = state.stats.counters["commits.replay_merge"]
+    found = []
+    _walk(state, steps, prefix, merges, length, found)
+    return found
+
+
+# The base loaded in this process. Its commits keep their hashes between
+# the states forked from it.
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def _explore_snapshot(path, steps, prefix, length):
+    with _loaded_lock:
+        if path not in _loaded:
+            _loaded.clear()
+            base = Repository.load(path)
+            # Forking freezes the base, do that before anything can race it.
+            base.fork()
+            _loaded[path] = base
+        base = _loaded[path]
+    return _explore(base, steps, prefix, length)
+
+
+def _prefixes(count, length, tasks):
+    # The shortest prefixes there are at least tasks of, to hand out.
+    prefixes = [()]
+    depth = 0
+    while len(prefixes) < tasks and depth < length:
+        depth += 1
+        prefixes = list(itertools.permutations(range(count), depth))
+    return prefixes
+
+
+def explore(base, steps, length=None, executor=None):
+    """ Try every ordering of steps from base and sum up where they end up.
+
+    base is a Repository or the path of a saved one. Orderings are of
+    length of the steps, all of them by default, and those coming to the
+    same history are one Outcome. Given an executor they are spread over it
+    by prefix. Returns the Outcomes in the order first come to.
+    """
+    steps = list(steps)
+    if length is None:
+        length = len(steps)
+    if executor is None:
+        if not isinstance(base, Repository):
+            base = Repository.load(base)
+        found = _explore(base, steps, (), length)
+    else:
+        directory = None
+        if isinstance(base, Repository):
+            directory = tempfile.mkdtemp(prefix="simgit-explore-")
+            path = os.path.join(directory, "base.simgit")
+            base.save(path)
+        else:
+            path = base
+        try:
+            prefixes = _prefixes(len(steps), length, 4 * multiprocessing.cpu_count())
+            found = itertools.chain.from_iterable(executor.map(
+                _explore_snapshot, itertools.repeat(path), itertools.repeat(steps),
+                prefixes, itertools.repeat(length)))
+            found = list(found)
+        finally:
+            if directory is not None:
+                shutil.rmtree(directory)
+
+    outcomes = collections.OrderedDict()
+    for outcome in found:
+        ordering = tuple(steps[number].label for number in outcome.orderings)
+        key = outcome.state or ordering
+        if key in outcomes:
+            outcomes[key][1].append(ordering)
+        else:
+            outcomes[key] = (outcome, [ordering])
+    return [outcome._replace(orderings=tuple(orderings))
+            for outcome, orderings in outcomes.values()]
+
+
+def write_table(outcomes, out=None):
+    """ Print outcomes as a table, one row each with its first ordering. """
+    if out is None:
+        out = sys.stdout
+    print("%-12s %9s %7s %8s %6s %6s  %s" % (
+        "state", "orderings", "merges", "commits", "width", "lanes", "first ordering"),
+        file=out)
+    for outcome in outcomes:
+        ordering = ", ".join(outcome.orderings[0])
+        if outcome.error is not None:
+            print("%-12s %9d %7s %8s %6s %6s  %s: %s" % (
+                "error", len(outcome.orderings), "", "", "", "", ordering, outcome.error),
+                file=out)
+        else:
+            print("%-12s %9d %7d %8d %6d %6d  %s" % (
+                outcome.state[:12], len(outcome.orderings), outcome.replay_merges,
+                outcome.commits, outcome.width, outcome.lanes, ordering), file=out)
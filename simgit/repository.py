@@ -1,83 +1,105 @@
 from __future__ import print_function
 
 import abc
+import array
+import binascii
+import bisect
 import collections
 import contextlib
+import functools
+import gc
+import gzip
 import hashlib
+import heapq
+import io
 import itertools
+import json
+import mmap
+import operator
+import os
+import struct
+import subprocess
 import sys
+import threading
 
+from simgit.stats import NO_PHASES, Stats, clock
 
-class XmlText(object):
-    def __init__(self):
-        self._text = None
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-    def render(self):
-        print(self._text, end="")
 
-    @property
-    def content(self):
-        return self._text
+def _is_binary(out):
+    if isinstance(out, io.TextIOBase):
+        return False
+    if isinstance(out, (io.RawIOBase, io.BufferedIOBase)):
+        return True
+    return "b" in getattr(out, "mode", "")
 
-    @content.setter
-    def content(self, text):
-        self._text = text
 
+def _binary(out):
+    # Where to write bytes for out: out itself, or a text stream's buffer.
+    # Python 2 files take bytes either way.
+    if _is_binary(out) or (str is bytes and not isinstance(out, io.TextIOBase)):
+        return out
+    buffer = getattr(out, "buffer", None)
+    if buffer is None:
+        raise ValueError("Compressed output needs a binary file, not %r" % (out,))
+    out.flush()
+    return buffer
 
-class XmlTag(object):
-    def __init__(self, name):
-        self._name = name
-        self._attrs = {}
-        self._children = []
 
-    @property
-    def attrs(self):
-        return self._attrs
-
-    @attrs.setter
-    def attrs(self, attr_dict):
-        self._attrs = attr_dict
-
-    def render(self):
-        print("<%s" % self._name, end="")
-        for name, value in self.attrs.iteritems():
-            print(" %s=\"%s\"" % (name, value), end="")
-        if not self._children:
-            print("/>", end="")
-        else:
-            print(">", end="")
-            for child in self._children:
-                child.render()
-            print("</%s>" % self._name, end="")
+class XmlWriter(object):
+    """ Streams xml to a file object without building a tree first.
 
-    @contextlib.contextmanager
-    def child(self, name):
-        c = XmlTag(name)
-        self._children.append(c)
-        yield c
+    Fragments pile up in a list and go out with a single join every so
+    often. Binary file objects are written utf-8 encoded. Attributes are
+    given as (name, value) pairs and written in that order.
+    """
+    BUFFER = 2048
 
-    @contextlib.contextmanager
-    def text(self):
-        c = XmlText()
-        self._children.append(c)
-        yield c
+    def __init__(self, out):
+        self._out = out
+        self._binary = _is_binary(out)
+        self._pieces = []
 
+    def write(self, text):
+        self._pieces.append(text)
+        if len(self._pieces) >= self.BUFFER:
+            self.flush()
 
-class XmlDoc(object):
-    def __init__(self):
-        self._root = None
+    def flush(self):
+        data = "".join(self._pieces)
+        del self._pieces[:]
+        if self._binary and not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        self._out.write(data)
 
-    @contextlib.contextmanager
-    def root(self, name):
-        self._root = XmlTag(name)
-        yield self._root
+    @staticmethod
+    def _attrs(attrs):
+        return "".join(" %s=\"%s\"" % (name, value) for name, value in attrs)
+
+    def empty(self, name, attrs=()):
+        self.write("<%s%s/>" % (name, self._attrs(attrs)))
 
-    def render(self):
-        self._root.render()
+    def start(self, name, attrs=()):
+        self.write("<%s%s>" % (name, self._attrs(attrs)))
+
+    def end(self, name):
+        self.write("</%s>" % name)
+
+    @contextlib.contextmanager
+    def tag(self, name, attrs=()):
+        self.start(name, attrs)
+        yield self
+        self.end(name)
 
 
 class Commitish(object):
     __metaclass__ = abc.ABCMeta
+    __slots__ = ()
+
     @abc.abstractmethod
     def commitish(self):
         """ The commit represented by this thing. """
@@ -90,8 +112,120 @@ class Commitish(object):
         return str(self.commitish())
 
 
+class Change(object):
+    """ The commits which are revisions of one logical change.
+
+    Changes form a union-find forest, so two can be joined when a commit
+    turns out to replace another. Only the root holds the revisions.
+    """
+    __slots__ = ("_parent", "_revisions", "_owner")
+
+    def __init__(self, commit, owner=None):
+        self._parent = self
+        self._revisions = [commit]
+        self._owner = owner
+
+    def find(self):
+        root = self
+        while root._parent is not root:
+            root = root._parent
+        node = self
+        while node._parent is not root:
+            node._parent, node = root, node._parent
+        return root
+
+    @property
+    def revisions(self):
+        return list(self.find()._revisions)
+
+    def union(self, other, renumber=None):
+        mine = self.find()
+        theirs = other.find()
+        if mine is theirs:
+            return mine
+        if len(mine._revisions) < len(theirs._revisions):
+            mine, theirs = theirs, mine
+        # Renumber the smaller side after the bigger one.
+        offset = len(mine._revisions)
+        for commit in theirs._revisions:
+            if renumber is None:
+                commit._revision += offset
+                commit._lineage <<= offset
+            else:
+                renumber(commit, offset)
+        mine._revisions.extend(theirs._revisions)
+        theirs._revisions = None
+        theirs._parent = mine
+        return mine
+
+
+def _intern(message):
+    # Scenarios repeat the same messages over and over; share the strings.
+    if type(message) is str:
+        return _intern_str(message)
+    return message
+
+try:
+    _intern_str = sys.intern
+except AttributeError:
+    _intern_str = intern
+
+
+class IdAllocator(object):
+    """ Hands out the commit ids and branch numbers of one repository.
+
+    Commit ids are dense integers. The sha1 shown for a commit is derived
+    from the seed and its id only when it is needed, so the same script
+    with the same seed always draws the same hashes, no matter how many
+    other repositories are being built, in this thread or any other.
+    """
+    def __init__(self, seed=""):
+        self._seed = seed
+        self._lock = threading.Lock()
+        self._commits = 0
+        self._branches = 0
+
+    @property
+    def seed(self):
+        return self._seed
+
+    def commit_id(self):
+        with self._lock:
+            commit_id = self._commits
+            self._commits += 1
+        return commit_id
+
+    def commit_ids(self, count):
+        """ Hand out count commit ids in a row and return the first. """
+        with self._lock:
+            first = self._commits
+            self._commits += count
+        return first
+
+    def branch_num(self):
+        with self._lock:
+            self._branches += 1
+            return self._branches
+
+    @property
+    def count(self):
+        """ The number of commit ids handed out so far. """
+        return self._commits
+
+    def sha1(self, commit_id):
+        return hashlib.sha1(("%s/%d" % (self._seed, commit_id)).encode("utf-8")).hexdigest()
+
+
 class Commit(Commitish):
-    LAST_SHA1 = ""
+
+    # Histories can run to hundreds of thousands of commits so keep them
+    # small: no __dict__, and parents, ancestors and replaces are tuples
+    # which are shared when empty.
+    __slots__ = (
+        "_parents", "_sorted_parents", "_generation", "_id", "_repository",
+        "_ancestors", "_replaces", "_message", "_color", "_branch_num",
+        "_sha1", "_change", "_revision", "_lineage", "_digest",
+    )
 
     def __init__(self,
                  parents,
@@ -100,55 +234,67 @@ class Commit(Commitish):
                  sha1=None,
                  ancestors=None,
                  replaces=None):
-        # Just faking a progression through sha1s
+        parents = tuple(parents)
         self._parents = parents
-        if ancestors is None:
-            ancestors = []
-        if replaces is None:
-            replaces = []
-        self._ancestors = ancestors
-        self._replaces = replaces
-        self._message = message
+        if len(parents) > 1:
+            self._sorted_parents = tuple(sorted(parents, key=lambda c: c.branch_num))
+        else:
+            self._sorted_parents = parents
+        # Like git's commit-graph: one more than the highest parent, so a
+        # commit can only be an ancestor of commits with a higher generation.
+        if len(parents) == 1:
+            self._generation = parents[0]._generation + 1
+        else:
+            self._generation = 1 + max([p.generation for p in parents] or [0])
+        # Dense integer id, used as the bit number in reachability bitmaps.
+        self._repository = repository = branch.repository
+        self._id = repository.ids.commit_id()
+        self._ancestors = tuple(ancestors) if ancestors else ()
+        self._replaces = replaces = tuple(replaces) if replaces else ()
+        self._message = _intern(message)
         self._color = branch.color
         self._branch_num = branch.num
+        # Unless given, the sha1 is made from the seed and id when asked for.
         self._sha1 = sha1
-        if sha1 is None:
-            self._sha1 = hashlib.sha1(Commit.LAST_SHA1).hexdigest()
-            Commit.LAST_SHA1 = self.sha1
-        self._x = None
-        self._y = None
-        self._max_x = sys.maxsize
+        self._digest = None
+
+        # A commit is a revision of the same change as the first commit it
+        # replaces. _lineage has a bit set for the ordinal of every revision
+        # of that change which this one supersedes, itself included.
+        self._change = None
+        self._revision = 0
+        self._lineage = 1
+        if replaces:
+            change = repository._own_change(replaces[0])
+            self._change = change
+            self._revision = len(change._revisions)
+            self._lineage = 1 << self._revision
+            change._revisions.append(self)
+            for replaced in replaces:
+                if repository._change_of(replaced, False) is change:
+                    self._lineage |= repository._numbering(replaced)[1]
+        repository._touch(self)
+        if repository._shared is not None:
+            repository._note_referrer(self, itertools.chain(parents, self._ancestors, replaces))
 
     @property
     def branch_num(self):
          return self._branch_num
 
     @property
-    def x(self):
-         return self._x
-
-    @x.setter
-    def x(self, value):
-        self._x = value
+    def repository(self):
+        return self._repository
 
     @property
-    def y(self):
-         return self._y
-
-    @y.setter
-    def y(self, value):
-        self._y = value
+    def id(self):
+        return self._id
 
     @property
-    def max_x(self):
-         return self._max_x
-
-    @max_x.setter
-    def max_x(self, value):
-        self._max_x = value
+    def generation(self):
+        return self._generation
 
     def __str__(self):
-        return self._sha1
+        return self.sha1
 
     @classmethod
     def Rebase(cls, parents, ancestors, commit, branch=None):
@@ -160,6 +306,8 @@ class Commit(Commitish):
 
     @property
     def sha1(self):
+        if self._sha1 is None:
+            self._sha1 = self._repository.ids.sha1(self._id)
         return self._sha1
 
     def name(self):
@@ -174,19 +322,70 @@ class Commit(Commitish):
         return self._ancestors
 
     def add_ancestor(self, ancestor):
-        self._ancestors.append(ancestor)
+        repository = self._repository
+        repository._check_writable(self)
+        repository._unhash(self)
+        self._ancestors += (ancestor,)
+        repository._touch(self, walk=True)
+        if repository._shared is not None:
+            repository._note_referrer(self, (ancestor,))
 
     @property
     def replaces(self):
         return self._replaces
 
     def add_replaces(self, replaces):
-        self._replaces.append(replaces)
+        repository = self._repository
+        repository._check_writable(self)
+        repository._unhash(self)
+        self._replaces += (replaces,)
+        if len(self._replaces) == 1:
+            repository._union(self, replaces)
+        self._link_revision(replaces)
+        repository._touch(self, columns=True)
+        if repository._shared is not None:
+            repository._note_referrer(self, (replaces,))
+
+    def _link_revision(self, replaced):
+        # Everything superseding this commit now supersedes replaced too.
+        repository = self._repository
+        change = repository._change_of(self)
+        if repository._change_of(replaced, False) is not change:
+            return
+        lineage = repository._numbering(replaced)[1]
+        bit = repository._numbering(self)[0]
+        for revision in change._revisions:
+            number, superseded = repository._numbering(revision)
+            if superseded >> bit & 1 and superseded | lineage != superseded:
+                repository._number(revision, number, superseded | lineage)
+
+    @property
+    def change(self):
+        return self._repository._change_of(self)
+
+    @property
+    def revision(self):
+        return self._repository._numbering(self)[0]
+
+    def same_change(self, other):
+        change_of = self._repository._change_of
+        return change_of(self) is change_of(other)
+
+    def supersedes(self, other):
+        """ Whether other is an older revision of the change than this one. """
+        return self._repository._supersedes(self, other)
 
     @property
     def message(self):
         return self._message
 
+    @message.setter
+    def message(self, message):
+        self._repository._check_writable(self)
+        self._repository._unhash(self)
+        self._message = _intern(message)
+        self._repository._touch(self)
+
     def commitish(self):
         return self
 
@@ -194,12 +393,86 @@ class Commit(Commitish):
     def color(self):
         return self._color
 
+    @property
+    def structural_hash(self):
+        """ A Merkle hash of the commit, as hex.
+
+        It covers the message and the hashes of the parents, replaces and
+        ancestors, but not sha1s, colours or branches. Hashes are kept, so only
+        commits made or changed since cost anything.
+        """
+        return binascii.hexlify(_digest(self)[1][:20]).decode("ascii")
+
+    def _copy(self, repository):
+        # The same commit, for repository to change. The sha1 can't be made
+        # again from another repository's seed, so it goes along.
+        copy = Commit.__new__(Commit)
+        for slot in Commit.__slots__:
+            setattr(copy, slot, getattr(self, slot))
+        copy._sha1 = self.sha1
+        copy._repository = repository
+        copy._digest = None
+        return copy
+
+
+_SELF = b"\0" * 20
+
+
+def _digest(commit):
+    # The digests of commit, (epoch, structure + look), worked out for what
+    # it points to first and kept on every commit on the way. The look adds
+    # what is drawn of a commit to its structure, for caching renders.
+    digest = commit._digest
+    if digest is not None and digest[0] == commit._repository._digest_epoch:
+        return digest
+    stack = [commit]
+    entered = set()
+    while stack:
+        top = stack[-1]
+        digest = top._digest
+        if digest is not None and digest[0] == top._repository._digest_epoch:
+            stack.pop()
+            continue
+        pointees = top._parents + top._replaces + top._ancestors
+        pending = [p for p in pointees if p is not top and (
+            p._digest is None or p._digest[0] != p._repository._digest_epoch)]
+        if pending:
+            if top in entered:
+                raise Exception("The history loops through commit %s" % top.sha1)
+            entered.add(top)
+            stack.extend(pending)
+            continue
+        stack.pop()
+        structure = hashlib.sha1(("%d %d %d\0" % (
+            len(top._parents), len(top._replaces), len(top._ancestors))).encode("ascii"))
+        look = hashlib.sha1()
+        for pointee in pointees:
+            if pointee is top:
+                # Rebasing onto where a branch already is makes the commit
+                # an ancestor of itself.
+                structure.update(_SELF)
+                look.update(_SELF)
+                continue
+            digest = pointee._digest[1]
+            structure.update(digest[:20])
+            look.update(digest[20:])
+            pointee._repository._mark_hashed(pointee)
+        structure.update(_encode(top._message or ""))
+        structure = structure.digest()
+        look.update(structure)
+        look.update(_encode("%s %s %d" % (top.sha1, top._color, top._branch_num)))
+        repository = top._repository
+        top._digest = (repository._digest_epoch, structure + look.digest())
+    return commit._digest
+
 
 class Color(object):
     def __init__(self, r, g, b):
         self._r = r
         self._g = g
         self._b = b
+        self._string = "#%02x%02x%02x" % (r, g, b)
+        self._lightened = None
 
     @classmethod
     def FromString(cls, string):
@@ -212,60 +485,552 @@ class Color(object):
         raise Exception("Bad color string")
 
     def __str__(self):
-        return "#%02x%02x%02x" % (self._r, self._g, self._b)
+        return self._string
 
     def __eq__(self, o):
         return self._r == o._r and self._g == o._g and self._b == o._b
 
     def lighten(self):
-        high = int("ff", 16)
-        new_r = self._r + (high - self._r) * 3 / 4
-        new_g = self._g + (high - self._g) * 3 / 4
-        new_b = self._b + (high - self._b) * 3 / 4
-        return self.__class__(r=new_r, g=new_g, b=new_b)
+        # Every element drawn inactive asks for this, so only do it once.
+        if self._lightened is None:
+            high = int("ff", 16)
+            new_r = self._r + (high - self._r) * 3 // 4
+            new_g = self._g + (high - self._g) * 3 // 4
+            new_b = self._b + (high - self._b) * 3 // 4
+            self._lightened = self.__class__(r=new_r, g=new_g, b=new_b)
+        return self._lightened
 
 
 def dfs_visit(branches, visit_parents=True, visit_ancestors=False, visit_replaces=False):
-    if not isinstance(branches, list):
+    """Yield commits reachable from branches in depth-first post-order.
+
+    Parents are followed lowest branch number first, then replaces pointers.
+    Ancestors are queued up behind the branches and visited once the earlier
+    ones are exhausted. The walk uses an explicit stack so that deep histories
+    neither hit the recursion limit nor pay for a chain of nested generators.
+    """
+    if isinstance(branches, Commitish):
         branches = [branches]
+    else:
+        branches = list(branches)
+    walk = _dfs_walk(branches, set(), visit_parents, visit_ancestors, visit_replaces)
+    stats = branches[0].repository._stats if branches else None
+    if stats is not None:
+        return stats.counted("dfs_visit", walk)
+    return walk
+
+
+def _dfs_walk(branches, seen, visit_parents, visit_ancestors, visit_replaces,
+              ancestors=None):
+    # Anything already in seen (by id) is treated as visited: it is neither
+    # yielded nor walked through. Given an ancestors deque, ancestors pointers
+    # are collected there for the caller instead of being walked.
+    if isinstance(branches, Commitish):
+        branches = [branches]
+    pending = collections.deque(branches)
+    if ancestors is None:
+        ancestors = pending
 
-    seen = set()
-    def visit(commit):
-        if commit.sha1 in seen:
-            return
-        seen.add(commit.sha1)
-
+    def enter(commit):
+        seen.add(commit._id)
         if visit_ancestors:
-            for parent in commit.ancestors:
-                branches.append(parent)
-        parents = []
+            ancestors.extend(commit.ancestors)
+        if visit_parents and visit_replaces:
+            return iter(commit._sorted_parents + commit._replaces)
         if visit_parents:
-            parents += sorted(commit.parents, key=lambda c: c.branch_num)
+            return iter(commit._sorted_parents)
         if visit_replaces:
-            parents += commit.replaces
-        for parent in parents:
-            for child in visit(parent):
-                yield child
+            return iter(commit._replaces)
+        return iter(())
+
+    while pending:
+        commit = pending.popleft().commitish()
+        if commit is None or commit._id in seen:
+            continue
+        stack = [(commit, enter(commit))]
+        while stack:
+            commit, parents = stack[-1]
+            for parent in parents:
+                if parent._id not in seen:
+                    stack.append((parent, enter(parent)))
+                    break
+            else:
+                stack.pop()
+                yield commit
+
+
+def _add_children(children, commits):
+    # Note commits as children, by id, of their parents and the commits they
+    # replace.
+    for commit in commits:
+        for parent in itertools.chain(commit._parents, commit._replaces):
+            children.setdefault(parent._id, []).append(commit)
+
+
+def _new_section(head, section, own, size, segments, walked):
+    # The commits with ids from size on that the walk of a branch comes to
+    # from head, in the order it yields them, for Repository._place_more.
+    # The branch's section of the last walk, if it had one, ends with own,
+    # its old head, and all of the new commits have to come after it. The
+    # other commits placed before have to be in sections already walked.
+    # None if it isn't like that, or a new commit points anywhere new.
+    if head is None:
+        return [] if own is None else None
+    found = own is None
+    block = []
+    stack = [(None, iter((head,)))]
+    while stack:
+        for commit in stack[-1][1]:
+            i = commit._id
+            if i < size:
+                if commit is own and not found:
+                    if block:
+                        return None
+                    found = True
+                elif not (segments[i] < section or found and segments[i] == section):
+                    return None
+                continue
+            if i in walked:
+                continue
+            if commit._ancestors or any(r._id >= size or segments[r._id] == _UNPLACED
+                                        for r in commit._replaces):
+                return None
+            walked.add(i)
+            stack.append((commit, iter(commit._sorted_parents)))
+            break
+        else:
+            commit = stack.pop()[0]
+            if commit is not None:
+                block.append(commit)
+    return block if found else None
+
+
+def _replaces_reach(commit, old):
+    # Whether old is commit, or one it replaces however far back.
+    return any(c is old for c in _dfs_walk([commit], set(), False, False, True))
+
+
+def is_ancestor(ancestor, descendant):
+    """Whether ancestor is reachable from descendant through parent pointers.
 
-        yield commit
+    A commit counts as its own ancestor. The walk never descends below the
+    generation of ancestor so it only touches the commits between the two.
+    """
+    ancestor = ancestor.commitish()
+    descendant = descendant.commitish()
+    if ancestor is None or descendant is None:
+        return False
+    if ancestor is descendant:
+        return True
+
+    generation = ancestor.generation
+    if generation >= descendant.generation:
+        return False
+    seen = set()
+    stack = [descendant]
+    while stack:
+        for parent in stack.pop().parents:
+            if parent is ancestor:
+                return True
+            if parent.generation > generation and parent not in seen:
+                seen.add(parent)
+                stack.append(parent)
+    return False
+
+
+_PARENT1 = 1
+_PARENT2 = 2
+_STALE = 4
+
+
+def _paint_down_to_common(one, two):
+    """Paint the histories of one and two until they meet, like git does.
+
+    Commits are popped highest generation first so that every commit has all
+    of its flags by the time it is popped. The walk stops once only commits
+    below a merge base remain queued. Returns a dict mapping each painted
+    commit to its flags, and the merge bases, best first.
+    """
+    flags = {one: _PARENT1}
+    flags[two] = flags.get(two, 0) | _PARENT2
+    order = itertools.count()
+    queue = []
+    nonstale = 0
+    for commit in (one, two) if one is not two else (one,):
+        heapq.heappush(queue, (-commit.generation, next(order), commit, True))
+        nonstale += 1
+
+    bases = []
+    while nonstale:
+        _, _, commit, counted = heapq.heappop(queue)
+        if counted:
+            nonstale -= 1
+        commit_flags = flags[commit]
+        if commit_flags & (_PARENT1 | _PARENT2 | _STALE) == _PARENT1 | _PARENT2:
+            bases.append(commit)
+            commit_flags |= _STALE
+            flags[commit] = commit_flags
+        for parent in commit.parents:
+            parent_flags = flags.get(parent, 0)
+            if parent_flags | commit_flags == parent_flags:
+                continue
+            parent_flags |= commit_flags
+            flags[parent] = parent_flags
+            counted = not parent_flags & _STALE
+            heapq.heappush(queue, (-parent.generation, next(order), parent, counted))
+            nonstale += counted
+    return flags, bases
+
+
+def merge_base(one, two):
+    """The best common ancestor of one and two, or None if they share none."""
+    one = one.commitish()
+    two = two.commitish()
+    if one is None or two is None:
+        return None
+    _, bases = _paint_down_to_common(one, two)
+    return bases[0] if bases else None
+
+
+def _dfs_visit_painted(tip, flags, exclude):
+    # Every parent of a commit that only tip reaches has been painted, so
+    # marking the painted commits carrying the exclude flag as seen stops the
+    # walk right at the boundary without losing the dfs_visit order.
+    seen = {c._id for c, f in flags.items() if f & exclude}
+    return _dfs_walk(tip, seen, True, False, False)
+
+
+def dfs_visit_range(upstream, head):
+    """Yield commits reachable from head but not from upstream (upstream..head)
+
+    The commits come out in the same order as dfs_visit(head) would yield
+    them. Only the commits back to the merge base get walked.
+    """
+    head = head.commitish()
+    if head is None:
+        return iter(())
+    upstream = upstream.commitish()
+    if upstream is None:
+        return dfs_visit(head)
+    flags, _ = _paint_down_to_common(upstream, head)
+    return _dfs_visit_painted(head, flags, _PARENT1)
+
+
+def newest(branches, count):
+    """ The count newest commits reachable from branches, newest first.
+
+    Newest is by generation, highest first, so this only looks at the
+    commits it returns and the ones just behind them.
+    """
+    if isinstance(branches, Commitish):
+        branches = [branches]
+    heap = []
+    seen = set()
+    for branch in branches:
+        commit = branch.commitish()
+        if commit is not None and commit._id not in seen:
+            seen.add(commit._id)
+            heapq.heappush(heap, (-commit._generation, commit._id, commit))
+    commits = []
+    while heap and len(commits) < count:
+        commit = heapq.heappop(heap)[2]
+        commits.append(commit)
+        for parent in commit._parents:
+            if parent._id not in seen:
+                seen.add(parent._id)
+                heapq.heappush(heap, (-parent._generation, parent._id, parent))
+    return commits
+
+
+def _symmetric_difference(one, two):
+    # Returns (one..two, two..one) as lists from a single painting walk.
+    flags, _ = _paint_down_to_common(one, two)
+    return (list(_dfs_visit_painted(two, flags, _PARENT1)),
+            list(_dfs_visit_painted(one, flags, _PARENT2)))
+
+
+def _bitmap_from_ids(ids):
+    ids = list(ids)
+    if len(ids) < 64:
+        bits = 0
+        for i in ids:
+            bits |= 1 << i
+        return bits
+    buf = bytearray((max(ids) >> 3) + 1)
+    for i in ids:
+        buf[i >> 3] |= 1 << (i & 7)
+    buf.reverse()
+    return int(binascii.hexlify(bytes(buf)), 16)
+
+
+def _bitmap_to_bytes(bits):
+    hexed = "%x" % bits
+    if len(hexed) % 2:
+        hexed = "0" + hexed
+    buf = bytearray(binascii.unhexlify(hexed))
+    buf.reverse()
+    return buf
+
+
+class ReachabilityIndex(object):
+    """ Bitmaps, as ints, of the commits reachable from branch tips.
+
+    Bit n is set when the commit with id n is reachable through parents.
+    Moving heads keep the tips' bitmaps current, and bitmaps of other
+    commits asked for recently are kept too.
+    """
+    RECENT = 256
 
-    while branches:
-        branch = branches[0]
-        branches = branches[1:]
-        for commit in visit(branch.commitish()):
-            yield commit
+    def __init__(self):
+        self._tips = {}
+        self._tip_counts = collections.defaultdict(int)
+        self._recent = collections.OrderedDict()
+        # Renders may ask for bitmaps from several threads at once.
+        self._lock = threading.Lock()
+
+    def head_moved(self, old, new):
+        with self._lock:
+            self._head_moved(old, new)
+
+    def _head_moved(self, old, new):
+        if new is not None:
+            bitmap = self._bitmap(new)
+            self._tip_counts[new] += 1
+            self._tips[new] = bitmap
+            self._recent.pop(new, None)
+        if old is not None:
+            self._tip_counts[old] -= 1
+            if not self._tip_counts[old]:
+                del self._tip_counts[old]
+                self._remember(old, self._tips.pop(old))
+
+    def copy(self):
+        """ Another index knowing all this one does, for a fork. """
+        with self._lock:
+            index = ReachabilityIndex()
+            index._tips = dict(self._tips)
+            index._tip_counts.update(self._tip_counts)
+            index._recent = collections.OrderedDict(self._recent)
+        return index
+
+    def replaced(self, old, new):
+        """ Let new, a copy of commit old, take over its bitmap. """
+        with self._lock:
+            if old in self._tips:
+                self._tips[new] = self._tips.pop(old)
+                self._tip_counts[new] = self._tip_counts.pop(old)
+            if old in self._recent:
+                self._recent[new] = self._recent.pop(old)
+
+    def _remember(self, commit, bitmap):
+        self._recent[commit] = bitmap
+        if len(self._recent) > self.RECENT:
+            self._recent.popitem(last=False)
+
+    def _cached(self, commit):
+        bitmap = self._tips.get(commit)
+        if bitmap is None:
+            bitmap = self._recent.pop(commit, None)
+            if bitmap is not None:
+                self._recent[commit] = bitmap
+        return bitmap
+
+    def bitmap(self, commitish):
+        """ The bitmap of every commit reachable from commitish. """
+        commit = commitish.commitish() if commitish is not None else None
+        if commit is None:
+            return 0
+        with self._lock:
+            return self._bitmap(commit)
+
+    def _bitmap(self, commit):
+        bitmap = self._cached(commit)
+        if bitmap is not None:
+            return bitmap
+
+        # Walk down until running into commits with known bitmaps.
+        bitmap = 0
+        ids = []
+        seen = {commit}
+        stack = [commit]
+        while stack:
+            c = stack.pop()
+            cached = self._cached(c) if c is not commit else None
+            if cached is not None:
+                bitmap |= cached
+                continue
+            ids.append(c.id)
+            for parent in c.parents:
+                if parent not in seen:
+                    seen.add(parent)
+                    stack.append(parent)
+        bitmap |= _bitmap_from_ids(ids)
+        self._remember(commit, bitmap)
+        return bitmap
+
+    def reachable(self, commitishes):
+        """ The union of the bitmaps of all of the given commitishes. """
+        if isinstance(commitishes, Commitish):
+            commitishes = [commitishes]
+        bitmap = 0
+        for commitish in commitishes:
+            bitmap |= self.bitmap(commitish)
+        return bitmap
+
+    @staticmethod
+    def contains(bitmap):
+        """ A predicate testing commits for membership in bitmap.
+
+        Testing a bit of a big int costs as much as copying it, so the bitmap
+        is unpacked into bytes once up front to make each test constant time.
+        """
+        buf = _bitmap_to_bytes(bitmap)
+        size = len(buf)
+        def contains(commit):
+            i = commit.id
+            return (i >> 3) < size and bool(buf[i >> 3] >> (i & 7) & 1)
+        return contains
+
+    @staticmethod
+    def count(bitmap):
+        return bin(bitmap).count("1")
+
+
+# How many threads are in _gc_paused, and whether collection was on when
+# the first of them came in.
+_gc_pauses = [0, False]
+_gc_pauses_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    # Making lots of objects which all live on sets off collection after
+    # collection, each going over everything made so far. Collection is
+    # process wide, so it's off while any thread is in here and back on,
+    # if it was on, once the last one is out.
+    with _gc_pauses_lock:
+        if not _gc_pauses[0]:
+            _gc_pauses[1] = gc.isenabled()
+            gc.disable()
+        _gc_pauses[0] += 1
+    try:
+        yield
+    finally:
+        with _gc_pauses_lock:
+            _gc_pauses[0] -= 1
+            if not _gc_pauses[0] and _gc_pauses[1]:
+                gc.enable()
+
+
+def _chain(repository, parent, color, branch_num, first, messages):
+    # A line of plain commits, one per message, on top of parent. What
+    # Commit's constructor would make, less all of the checks.
+    generation = parent._generation if parent is not None else 0
+    new = Commit.__new__
+    intern = _intern
+    commits = [None] * len(messages)
+    for n, message in enumerate(messages):
+        commit = new(Commit)
+        commit._parents = commit._sorted_parents = (parent,) if parent is not None else ()
+        generation += 1
+        commit._generation = generation
+        commit._id = first + n
+        commit._repository = repository
+        commit._ancestors = commit._replaces = ()
+        commit._message = intern(message)
+        commit._color = color
+        commit._branch_num = branch_num
+        commit._sha1 = commit._change = commit._digest = None
+        commit._revision = 0
+        commit._lineage = 1
+        commits[n] = parent = commit
+    return commits
+
+
+class _SharedHistory(object):
+    """ The history a repository and its forks share, as it was at the fork.
+
+    None of it changes in place after the fork. To change a commit, each
+    repository copies it, and the commits pointing to it, and so on. Those
+    are found here, indexed on first use for all of the forks at once.
+    """
+    def __init__(self, heads, size):
+        self.heads = heads
+        self._size = size
+        self._starts = None
+        self._referrers = None
+        self._lock = threading.Lock()
+
+    def referrers(self, commit):
+        """ The shared commits with commit as parent, ancestor or replaced. """
+        with self._lock:
+            if self._starts is None:
+                self._index()
+        start = self._starts[commit._id]
+        return self._referrers[start:self._starts[commit._id + 1]]
+
+    def _index(self):
+        # Compressed rows: the referrers of commit n are in
+        # referrers[starts[n]:starts[n + 1]].
+        commits = list(_dfs_walk(self.heads, set(), True, True, True))
+        starts = array.array("i", [0]) * (self._size + 1)
+        for commit in commits:
+            for pointee in itertools.chain(commit._parents, commit._ancestors, commit._replaces):
+                starts[pointee._id + 1] += 1
+        for n in range(self._size):
+            starts[n + 1] += starts[n]
+        fill = array.array("i", starts)
+        referrers = [None] * starts[self._size]
+        for commit in commits:
+            for pointee in itertools.chain(commit._parents, commit._ancestors, commit._replaces):
+                referrers[fill[pointee._id]] = commit
+                fill[pointee._id] += 1
+        self._starts = starts
+        self._referrers = referrers
+
+
+def _operation(method):
+    """ Tell the repository when a branch operation is over.
+
+    Only the outermost operation counts, and only if it didn't raise. With
+    stats on, each is timed as branch.<method> and the commits it made are
+    counted as commits.<method>.
+    """
+    name = method.__name__
+
+    @functools.wraps(method)
+    def operation(self, *args, **kwargs):
+        repository = self._repository
+        stats = repository._stats
+        if stats is not None:
+            start = clock()
+            made = repository._ids.count
+        repository._operations += 1
+        try:
+            result = method(self, *args, **kwargs)
+        finally:
+            repository._operations -= 1
+            if stats is not None:
+                stats.time("branch." + name, clock() - start)
+                stats.count("commits." + name, repository._ids.count - made)
+        if not repository._operations:
+            repository._operation_done(self, name)
+        return result
+    return operation
 
 
 class Branch(Commitish):
-    NUM_BRANCHES = 0
     def __init__(self, repository, head, name, color):
         self._repository = repository
         self._head = head
         self._name = name
         self._color = Color.FromString(color)
         self._downstreams = set()
-        Branch.NUM_BRANCHES += 1
-        self._num = Branch.NUM_BRANCHES
+        self._num = repository.ids.branch_num()
+
+    @property
+    def repository(self):
+        return self._repository
 
     @property
     def head(self):
@@ -286,24 +1051,49 @@ class Branch(Commitish):
     def commitish(self):
         return self.head
 
+    @_operation
     def commit(self, message):
         if self._head:
             parents = [self._head]
         else:
             parents = []
         commit = Commit(parents=parents, message=message, branch=self)
-        self._head = commit
+        self._set_head(commit)
         return commit
 
+    @_operation
+    def commit_many(self, messages):
+        """ Commit each of messages in turn and return the new commits.
+
+        The same as calling commit for each but much quicker for long
+        chains: the ids are taken in one go, the commits are made without
+        going through Commit's constructor, and the repository and its
+        indexes hear about them once, at the end.
+        """
+        messages = list(messages)
+        if not messages:
+            return []
+        repository = self._repository
+        first = repository.ids.commit_ids(len(messages))
+        with _gc_paused():
+            commits = _chain(repository, self._head, self._color, self._num, first, messages)
+        repository._touch_many(commits)
+        if repository._shared is not None:
+            repository._note_referrer(commits[0], commits[0]._parents)
+        self._set_head(commits[-1])
+        return commits
+
+    @_operation
     def cherry_pick(self, commit):
         if self._head:
             parents = [self._head]
         else:
             parents = []
         rebased = Commit.Rebase(parents=parents, ancestors=[commit], branch=self, commit=commit)
-        self._head = rebased
+        self._set_head(rebased)
         return rebased
 
+    @_operation
     def branch(self, name, color=None):
         # TODO Do I really want to make it the same color or a different color?
         if color is None:
@@ -312,6 +1102,7 @@ class Branch(Commitish):
         self._downstreams.add(new_branch)
         return new_branch
 
+    @_operation
     def merge(self, others, message=None):
         if isinstance(others, Commitish):
             others = [others]
@@ -324,13 +1115,12 @@ class Branch(Commitish):
         # See if fast-forward is possible
         if len(others) == 1:
             other = others[0]
-            for commit in dfs_visit(other):
-                if commit == self.commitish():
-                    # If you want the commit to show up on the master lane in
-                    # gray, uncomment this.
-                    # other.commitish()._color = self.color
-                    self.reset(other)
-                    return self.commitish()
+            if is_ancestor(self, other):
+                # If you want the commit to show up on the master lane in
+                # gray, uncomment this.
+                # other.commitish()._color = self.color
+                self.reset(other)
+                return self.commitish()
 
         parents = [self.commitish()]
         for other in others:
@@ -338,12 +1128,31 @@ class Branch(Commitish):
         if message is None:
             message = "Merging %s into %s" % ([o.name for o in others], self.name)
         merge_commit = Commit(parents, message, branch=self)
-        self._head = merge_commit
+        self._set_head(merge_commit)
         return merge_commit
 
+    @_operation
     def reset(self, branch):
-        self._head = branch.commitish()
+        self._set_head(branch.commitish())
 
+    def _set_head(self, commit):
+        old = self._head
+        self._head = commit
+        self._repository._head_moved(old, commit)
+
+    def _own_head(self):
+        # The head, ready to change in place. After a fork that can mean
+        # copying it first.
+        return self._repository._own(self._head)
+
+    def _add_head_ancestor(self, old):
+        # Owning the head copies old too when the head hasn't moved from it,
+        # and then the copy is what was there.
+        repository = self._repository
+        head = self._own_head()
+        head.add_ancestor(repository._owned.get(old._id, old))
+
+    @_operation
     def rebase(self, other, fixups=None):
         if fixups is None:
             fixups = set()
@@ -352,57 +1161,58 @@ class Branch(Commitish):
         old = self.commitish()
         self.reset(other)
 
-        # Mark the commits reachable from the other branch
-        seen = set()
-        for commit in dfs_visit(other.commitish()):
-            seen.add(commit.sha1)
-
         # List the commits that aren't on the other branch
-        to_rebase = []
-        for commit in dfs_visit(old):
-            if commit.sha1 in seen:
-                continue
-            if commit.sha1 not in fixups:
-                to_rebase.append(commit)
+        to_rebase = [c for c in dfs_visit_range(other, old)
+                     if c.sha1 not in fixups]
 
         for commit in to_rebase:
             self.cherry_pick(commit)
 
-        self.commitish().add_ancestor(old)
+        self._add_head_ancestor(old)
         return self.commitish()
 
+    @_operation
     def fixup_rebase(self, original, fixup):
         self.rebase(original.parents[0], fixups={fixup.sha1})
 
     # This is almost the same as the other one.
+    @_operation
     def replay_merge(self, commits):
         if self._head:
             parents = [self._head]
         else:
             parents = []
         replayed = Commit.Replay(parents=parents, replaces=commits, branch=self, commit=commits[0])
-        self._head = replayed
+        # The replaced commits are all revisions of the same change now.
+        for commit in commits[1:]:
+            self._repository._union(replayed, commit)
+            replayed._link_revision(commit)
+        self._set_head(replayed)
         return replayed
 
+    @_operation
     def replay_commit(self, commit):
         if self._head:
             parents = [self._head]
         else:
             parents = []
         replayed = Commit.Replay(parents=parents, replaces=[commit], branch=self, commit=commit)
-        self._head = replayed
+        self._set_head(replayed)
         return replayed
 
+    @_operation
     def replay_amend(self):
         old = self.commitish()
         replayed = Commit.Replay(parents=old.parents, replaces=[old], branch=self, commit=old)
-        self._head = replayed
+        self._set_head(replayed)
         replayed.add_ancestor(old)
 
+    @_operation
     def replay_squash(self, other, message):
         self.replay(other, squash=True)
-        self.commitish()._message = message
+        self._own_head().message = message
 
+    @_operation
     def replay(self, other, fixups=None, squash=False):
         # Replay has a direction. Always replay downstream onto upstream.
         if other in self._downstreams:
@@ -412,37 +1222,41 @@ class Branch(Commitish):
             self.replay(old, squash=squash)
             # Accessing the private _color attr. I know.
             # self.commitish()._color = self.color
-            self.commitish().add_ancestor(old)
+            self._add_head_ancestor(old)
             return self.commitish()
 
         # Check if this is a fast-forward situation.
-        if not squash:
-            for commit in dfs_visit(self.commitish()):
-                if commit == other.commitish():
-                    if not fixups:
-                        return
-
-        other_commits = {c for c in dfs_visit(other.commitish())}
-        my_commits = {c for c in dfs_visit(self.commitish())}
-        common_commits = other_commits & my_commits
-
-        # Map each commit to all old revisions of it by following only replaces pointers
-        revisions = collections.defaultdict(set)
-        for commit in (other_commits|my_commits) - common_commits:
-            for revision in dfs_visit(commit, visit_replaces=True, visit_parents=False):
-                if len(revisions[revision]):
+        if not squash and not fixups and is_ancestor(other, self):
+            return
+
+        # Only the commits on either side of the merge base matter here.
+        mine = self.commitish()
+        other_only, my_only = _symmetric_difference(mine, other.commitish())
+
+        # Map each commit to all old revisions of it by following only
+        # replaces pointers. Revisions share one set along replaces[0]. A
+        # commit whose change has no other revision is in a set of its own,
+        # so the change index spares the walk from those.
+        repository = self._repository
+        revisions = {}
+        for commit in itertools.chain(other_only, my_only):
+            change = repository._change_of(commit, False)
+            if change is None or len(change._revisions) < 2:
+                continue
+            for revision in _dfs_walk([commit], set(), False, False, True):
+                if revision in revisions:
                     continue
-                if len(revision.replaces):
-                    # Pull the set from the old revision to this one.
-                    # When we're finished the set will have all of the revisions of any given commit.
-                    revisions[revision] = revisions[revision.replaces[0]]
-                revisions[revision].add(revision)
+                if revision._replaces:
+                    group = revisions[revision._replaces[0]]
+                else:
+                    group = set()
+                group.add(revision)
+                revisions[revision] = group
 
         # Basically, fixups just get dropped for now.
-        skip_commits = other_commits | set(fixups or [])
+        skip_commits = set(fixups or [])
         originals = set(fixups.values()) if fixups else set()
-        to_replay = [c for c in dfs_visit(self.commitish())
-                     if c not in skip_commits]
+        to_replay = [c for c in my_only if c not in skip_commits]
 
         # Reset the branch to the other to begin replaying commits onto it.
         old = self.commitish()
@@ -453,6 +1267,7 @@ class Branch(Commitish):
         seen = set()
         fast_forward = True
 
+        matched = 0
         squash_replaces = []
         def reset_or_replay(commit):
             if fast_forward or squash:
@@ -462,14 +1277,10 @@ class Branch(Commitish):
                 return
             self.replay_commit(commit)
 
-        for commit in dfs_visit(other.commitish()):
-            if commit in common_commits:
-                continue
-
+        for commit in other_only:
             seen.add(commit)
 
-            all_revs = revisions[commit]
-            same_change_set = all_revs & my_commits
+            same_change_set = {r for r in revisions.get(commit, ()) if is_ancestor(r, mine)}
             if not same_change_set:
                 reset_or_replay(commit)
                 continue
@@ -478,23 +1289,25 @@ class Branch(Commitish):
                 raise Exception("There shouldn't be two old revisions of this change in a branch")
             other_rev = same_change_set.pop()
             seen.add(other_rev)
+            matched += 1
 
-            # See if the downstream is reachable from the upstream
-            for c in dfs_visit(commit, visit_replaces=True, visit_parents=False):
-                if c == other_rev:
-                    reset_or_replay(commit)
-                    break
+            if _replaces_reach(commit, other_rev):
+                # The downstream is an old revision of the upstream
+                reset_or_replay(commit)
+            elif _replaces_reach(other_rev, commit):
+                # The upstream is an old revision of the downstream
+                reset_or_replay(other_rev)
             else:
-                # See if the upstream is reachable from the downstream
-                for c in dfs_visit(other_rev, visit_replaces=True, visit_parents=False):
-                    if c == commit:
-                        reset_or_replay(other_rev)
-                        break
-                else:
-                    # Neither is reachable from the other. Merge them.
-                    fast_forward = False
-                    # TODO DO something for replay_squash here
-                    self.replay_merge([commit, other_rev])
+                # Neither is reachable from the other. Merge them.
+                fast_forward = False
+                # TODO DO something for replay_squash here
+                self.replay_merge([commit, other_rev])
+
+        stats = repository._stats
+        if stats is not None:
+            # Every matched pair asks which revision replaces the other.
+            stats.count("replay.commits_compared", len(other_only) + len(my_only))
+            stats.count("replay.replaces_walks", matched)
 
         for commit in to_replay:
             if commit in seen:
@@ -512,16 +1325,1108 @@ class Branch(Commitish):
                                      branch=self,
                                      commit=old)
             self.reset(replayed)
-        self.commitish().add_ancestor(old)
+        self._add_head_ancestor(old)
         return self.commitish()
 
+    @_operation
     def fixup_replay(self, original, fixups):
         self.replay(original.parents[0], fixups=fixups)
 
 
+class Layout(object):
+    """ Where Repository.place put each commit, column x and lane y.
+
+    Coordinates are kept in arrays by commit id, and a layout isn't changed
+    once made. It knows the layout it replaced and what was touched or
+    moved since, so a render can tell what to draw again.
+    """
+    _serials = itertools.count(1)
+
+    def __init__(self, commits, xs, ys, width, height, base=0, touched=frozenset(),
+                 active=0, moved=None, placement=None):
+        self._commits = tuple(commits)
+        # The first active commits are the ones reachable from a branch
+        # when the layout was made.
+        self._active = active
+        self._xs = xs
+        self._ys = ys
+        self._width = width
+        self._height = height
+        self._serial = next(Layout._serials)
+        self._base = base
+        # Commits by id. Moved ones are those placed before, elsewhere now,
+        # or None if that wasn't worked out.
+        self._touched = touched
+        self._moved = moved
+        self._placement = placement
+
+    @property
+    def commits(self):
+        """ The commits placed, in the order they are drawn. """
+        return self._commits
+
+    @property
+    def width(self):
+        return self._width
+
+    @property
+    def height(self):
+        return self._height
+
+    def x(self, commit):
+        return self._xs[commit.id]
+
+    def y(self, commit):
+        return self._ys[commit.id]
+
+    def position(self, commit):
+        return self._xs[commit.id], self._ys[commit.id]
+
+    def __contains__(self, commit):
+        return commit.id < len(self._xs) and self._xs[commit.id] != 0
+
+
+# What Repository._place leaves for the next layout to carry on from. heads
+# are the (name, head) of each branch and ends where each branch's section
+# of the walk ends. segments has the section of each commit by id, and
+# sequence a number which orders commits as they are drawn within one.
+# runs and lanes are the runs' first commits and lanes, pull and bound what
+# compaction had of each commit.
+_Placement = collections.namedtuple(
+    "_Placement", ["heads", "ends", "segments", "sequence", "next_sequence", "runs",
+                   "lanes", "pull", "bound"])
+
+# The sections of the obsoleted history, and of commits not placed at all.
+_OBSOLETE = 1 << 30
+_UNPLACED = (1 << 31) - 1
+
+
+class _Lanes(object):
+    """ Hands out lanes to runs of commits, top most lane with room first.
+
+    A segment tree over the last column taken in each lane finds the lane in
+    log time. Lanes not used yet count as free from column zero.
+    """
+    def __init__(self, first):
+        self._first = first
+        self._size = 1
+        self._tree = [-1, -1]
+        self.count = 0
+
+    def _grow(self):
+        leaves = self._tree[self._size:] + [-1] * self._size
+        self._size *= 2
+        self._tree = [-1] * self._size + leaves
+        for i in range(self._size - 1, 0, -1):
+            self._tree[i] = min(self._tree[2 * i], self._tree[2 * i + 1])
+
+    def take(self, start, end):
+        """ Take the columns start to end in a lane and return the lane. """
+        tree = self._tree
+        if tree[1] >= start - 1:
+            self._grow()
+            tree = self._tree
+        i = 1
+        while i < self._size:
+            i = 2 * i if tree[2 * i] < start - 1 else 2 * i + 1
+        lane = i - self._size
+        tree[i] = end
+        i //= 2
+        while i:
+            tree[i] = min(tree[2 * i], tree[2 * i + 1])
+            i //= 2
+        self.count = max(self.count, lane + 1)
+        return self._first + lane
+
+
+class Viewport(object):
+    """ The window of a layout to render, for histories too big to see whole.
+
+    columns and lanes are (first, last) pairs, both included, and either
+    can be None for all of them. Only the commits and edges in the window
+    are written, edges leaving it are cut off at the border.
+    """
+    def __init__(self, columns=None, lanes=None):
+        self._columns = columns
+        self._lanes = lanes
+
+    @classmethod
+    def around(cls, layout, commits):
+        """ The smallest viewport showing all of commits. """
+        xs = [layout.x(c) for c in commits]
+        ys = [layout.y(c) for c in commits]
+        return cls(columns=(min(xs), max(xs)), lanes=(min(ys), max(ys)))
+
+    @classmethod
+    def recent(cls, layout, branches, count):
+        """ The viewport showing the newest count commits of branches. """
+        return cls.around(layout, newest(branches, count))
+
+    def window(self, layout):
+        """ The first and last column, then the first and last lane. """
+        first_x, last_x = self._columns or (1, layout.width)
+        first_y, last_y = self._lanes or (1, layout.height)
+        return first_x, last_x, first_y, last_y
+
+    def select(self, layout):
+        """ The commits of layout to draw the edges of, and to draw. """
+        # The margin shows a column or lane either side, so count those too.
+        first_x, last_x, first_y, last_y = self.window(layout)
+        first_x, last_x, first_y, last_y = first_x - 1, last_x + 1, first_y - 1, last_y + 1
+        position = layout.position
+        edge_commits = []
+        circle_commits = []
+        for commit in layout.commits:
+            x, y = position(commit)
+            if first_x <= x <= last_x and first_y <= y <= last_y:
+                circle_commits.append(commit)
+            if x < first_x:
+                continue
+            for parent in itertools.chain(commit.parents, commit.replaces):
+                px, py = position(parent)
+                if px <= last_x and min(y, py) <= last_y and max(y, py) >= first_y:
+                    edge_commits.append(commit)
+                    break
+        return edge_commits, circle_commits
+
+
+def _tiles(first, last, size, count):
+    # The tiles of size columns (or lanes) showing any of first to last,
+    # counting each tile's margin of one either side.
+    return range(max(0, -(-(first - 1) // size) - 1), min(count - 1, last // size) + 1)
+
+
+# The svg drawn for each commit by one render, by commit id, kept so the next
+# render only has to format the commits that changed.
+_Fragments = collections.namedtuple(
+    "_Fragments", ["layout", "key", "active", "edges", "circles", "extra"])
+
+
+# What Repository._drawing sets up for drawing in one mode.
+_Drawing = collections.namedtuple(
+    "_Drawing", ["mode", "key", "fragments", "start", "edge_record", "circle_record",
+                 "palette", "extra"])
+
+
+# Commits drawn per task when rendering on an executor.
+_CHUNK = 4096
+
+
+def _format(mode, kind, records):
+    """ Turn the records of commits' edges or circles into svg, a string each.
+
+    This only deals in plain values so it can run in another process.
+    """
+    if kind == "circles":
+        if mode == "compact":
+            template = Repository.COMPACT_COMMIT
+            return [template % (60 * x, 60 * y, color, sha1[0:6], message)
+                    for x, y, sha1, color, message in records]
+        template = Repository.COMMIT_CIRCLE
+        return [template % (60 * y, 60 * x, sha1, color, sha1[0:6], message)
+                for x, y, sha1, color, message in records]
+
+    edge = Repository._edge
+    texts = []
+    if mode == "compact":
+        template = Repository.COMPACT_PATH
+        compact_edge = Repository._compact_edge
+        for edges in records:
+            texts.append("".join(
+                [template % (("r s%s" if replaces else "s%s") % color,
+                             compact_edge(px, py, x, y))
+                 for replaces, px, py, x, y, color, parent, sha1 in edges]))
+        return texts
+    for edges in records:
+        texts.append("".join(
+            [Repository.REPLACES_PATH % (edge(px, py, x, y), color, parent, sha1)
+             if replaces else
+             Repository.PARENT_PATH % (color, parent, sha1, edge(px, py, x, y))
+             for replaces, px, py, x, y, color, parent, sha1 in edges]))
+    return texts
+
+
+# Below this many commits setting up numpy costs more than it saves.
+_VECTORIZE = 2048
+
+# What _draw_vectorized takes from every commit, in C rather than a
+# Python loop each.
+_get_id = operator.attrgetter("_id")
+_get_color = operator.attrgetter("_color")
+_get_color_string = operator.attrgetter("_color._string")
+_get_replaces = operator.attrgetter("_replaces")
+_get_parents = operator.attrgetter("_parents")
+_get_message = operator.attrgetter("_message")
+
+
+def _draw_vectorized(drawing, layout, active):
+    """ Draw every commit of layout at once with numpy, if it is installed.
+
+    Returns the fragments as Repository._draw does, or None when compact
+    classes would be needed for colours outside the palette.
+    """
+    commits = layout.commits
+    size = len(layout._xs)
+    id_list = list(map(_get_id, commits))
+    ids = numpy.array(id_list, dtype=numpy.intp)
+    xs = 60 * numpy.frombuffer(layout._xs, dtype=numpy.intc).astype(numpy.intp)
+    ys = 60 * numpy.frombuffer(layout._ys, dtype=numpy.intc).astype(numpy.intp)
+    lit = numpy.frombuffer(bytes(active), dtype=numpy.uint8)[:size].astype(numpy.intp)
+
+    # Shade 2 * n is colour n as is and 2 * n + 1 lightened.
+    color_list = list(map(_get_color_string, commits))
+    # Colours of the same string are alike, any one of them will do.
+    colors = dict(zip(color_list, map(_get_color, commits)))
+    shades = []
+    for color in colors.values():
+        shades += [color._string, color.lighten()._string]
+    if drawing.mode == "compact":
+        palette, extra = drawing.palette, drawing.extra
+        shades = [palette.get(shade, extra.get(shade)) for shade in shades]
+        if None in shades:
+            return None
+    shades = numpy.array(shades, dtype=object)
+    index = dict((color, n) for n, color in enumerate(colors))
+    color_of = numpy.zeros(size, dtype=numpy.intp)
+    color_of[ids] = list(map(index.__getitem__, color_list))
+    sha1s = numpy.empty(size, dtype=object)
+    sha1s[ids] = [c.sha1 for c in commits]
+
+    # Every edge in drawing order: a commit's replaces, then its parents.
+    replaces_lists = list(map(_get_replaces, commits))
+    parents_lists = list(map(_get_parents, commits))
+    replaced = numpy.array(list(map(len, replaces_lists)), dtype=numpy.intp)
+    degrees = replaced + numpy.array(list(map(len, parents_lists)), dtype=numpy.intp)
+    ends = numpy.cumsum(degrees)
+    starts = ends - degrees
+    parent = numpy.array(list(map(_get_id, itertools.chain.from_iterable(
+        map(operator.add, replaces_lists, parents_lists)))), dtype=numpy.intp)
+    child = numpy.repeat(ids, degrees)
+    replaces = (numpy.arange(len(parent)) - numpy.repeat(starts, degrees)
+                < numpy.repeat(replaced, degrees)).astype(numpy.intp)
+    x, y, px, py = xs[child], ys[child], xs[parent], ys[parent]
+    middle = (py + y) // 2
+    # Replaces edges are light if the replaced commit is, parent edges if
+    # the child is.
+    edge_lit = numpy.where(replaces == 1, lit[parent], lit[child])
+    edge_shades = shades[2 * color_of[parent] + 1 - edge_lit]
+    columns = [a.tolist() for a in (replaces, px, py, x, middle, y, edge_shades)]
+
+    curve = "M%s,%s C%s,%s %s,%s %s,%s"
+    if drawing.mode == "compact":
+        line = "M%s,%sH%s"
+        templates = dict(((r, h), Repository.COMPACT_PATH % (
+            ("r s%s" if r else "s%s"), line if h else curve))
+            for r in (0, 1) for h in (False, True))
+        texts = [templates[r, b == d] % ((s, a, b, c) if b == d else (s, a, b, c, m, a, m, c, d))
+                 for r, a, b, c, m, d, s in zip(*columns)]
+    else:
+        child_sha1s = sha1s[child].tolist()
+        parent_sha1s = sha1s[parent].tolist()
+        replaces_path = Repository.REPLACES_PATH % (curve, "%s", "%s", "%s")
+        parent_path = Repository.PARENT_PATH % ("%s", "%s", "%s", curve)
+        texts = [replaces_path % (a, b, c, m, a, m, c, d, s, ps, cs) if r else
+                 parent_path % (s, ps, cs, a, b, c, m, a, m, c, d)
+                 for (r, a, b, c, m, d, s), ps, cs
+                 in zip(zip(*columns), parent_sha1s, child_sha1s)]
+    drawn_edges = dict(zip(id_list, ["".join(texts[a:b]) for a, b
+                                     in zip(starts.tolist(), ends.tolist())]))
+
+    circle_sha1s = sha1s[ids].tolist()
+    circle_shades = shades[2 * color_of[ids] + 1 - lit[ids]].tolist()
+    messages = list(map(_get_message, commits))
+    if drawing.mode == "compact":
+        template = Repository.COMPACT_COMMIT
+        circles = [template % (a, b, s, sha1[0:6], m) for a, b, s, sha1, m in zip(
+            xs[ids].tolist(), ys[ids].tolist(), circle_shades, circle_sha1s, messages)]
+    else:
+        template = Repository.COMMIT_CIRCLE
+        circles = [template % (b, a, sha1, s, sha1[0:6], m) for a, b, s, sha1, m in zip(
+            xs[ids].tolist(), ys[ids].tolist(), circle_shades, circle_sha1s, messages)]
+    return drawn_edges, dict(zip(id_list, circles))
+
+
+Frame = collections.namedtuple(
+    "Frame", ["label", "width", "height", "added", "changed", "removed"])
+
+
+def _compare(kind, commit, svg, drawn, added, changed, removed):
+    # Put a commit's element of kind in a frame's lists, if svg isn't what
+    # drawn had for it. Empty ones count as not there.
+    svg = svg or None
+    was = drawn.get(commit._id) or None
+    if svg is was:
+        return
+    name = "%s-%s" % (kind, commit.sha1)
+    if was is None:
+        added.append((name, svg))
+    elif svg is None:
+        removed.append(name)
+    elif svg != was:
+        changed.append((name, svg))
+
+
+class Recorder(object):
+    """ Records frames of a history as it is worked on, see Repository.record.
+
+    Each frame holds the elements, edges-<sha1> and commit-<sha1>, added or
+    drawn differently since the last one, as (name, svg) pairs in drawing
+    order, and the names of those removed.
+    """
+    def __init__(self, repository, active_branches=None):
+        self._repository = repository
+        self._active_branches = active_branches
+        self._fragments = None
+        self._frames = []
+
+    @property
+    def frames(self):
+        return self._frames
+
+    def frame(self, label=None):
+        """ Record the history as it is now, unless nothing changed.
+
+        If the layout was carried on from the last frame's, only the commits
+        touched, moved or made active since are looked at, along with the
+        edges into their children. Otherwise every commit is.
+        """
+        layout = self._repository.place()
+        old = self._fragments
+        if old is not None and old.layout is layout:
+            added, changed, removed = [], [], []
+        elif (old is not None and layout._moved is not None
+                and layout._base == old.layout._serial):
+            added, changed, removed = self._draw_more(layout)
+        else:
+            added, changed, removed = self._draw_all(layout)
+
+        size = (layout.width, layout.height)
+        if (self._frames and not (added or changed or removed)
+                and size == self._frames[-1][1:3]):
+            return None
+        frame = Frame(label, layout.width, layout.height, added, changed, removed)
+        self._frames.append(frame)
+        return frame
+
+    def _draw_all(self, layout):
+        repository = self._repository
+        active = repository._active(layout, self._active_branches)
+        drawing = repository._drawing(False, layout, active, cached=False)
+        old = self._fragments
+        drawn = Repository._draw(None, old, layout, active, drawing)
+        self._fragments = _Fragments(layout, None, active, drawn[0], drawn[1], None)
+
+        added = []
+        changed = []
+        removed = []
+        before = (old.edges, old.circles) if old is not None else ({}, {})
+        for kind, now, then in zip(("edges", "commit"), drawn, before):
+            for commit in layout.commits:
+                _compare(kind, commit, now[commit.id], then, added, changed, removed)
+            if old is not None:
+                for commit in old.layout.commits:
+                    if commit.id not in now and then[commit.id]:
+                        removed.append("%s-%s" % (kind, commit.sha1))
+        return added, changed, removed
+
+    def _draw_more(self, layout):
+        # Commits are only ever added to a layout carried on from another,
+        # and only ever become active, so the commits to look at are the
+        # ones touched, moved or newly active. The walk for the latter stops
+        # at the commits active already.
+        repository = self._repository
+        old = self._fragments
+        active = bytearray(old.active)
+        active.extend(bytearray(repository._ids.count - len(active)))
+        redraw = dict(layout._touched)
+        redraw.update(layout._moved)
+        heads = self._active_branches or list(repository._branches.values())
+        stack = [head.commitish() for head in heads]
+        while stack:
+            commit = stack.pop()
+            if commit is None or active[commit._id]:
+                continue
+            active[commit._id] = 1
+            redraw[commit._id] = commit
+            stack.extend(commit._parents)
+
+        # Edges are drawn from the parents, so those into the children of
+        # every commit redrawn are as well.
+        placement = layout._placement
+        segments, sequence = placement.segments, placement.sequence
+        def order(commit):
+            return segments[commit._id], sequence[commit._id]
+        circle_commits = sorted((c for c in redraw.values() if c in layout), key=order)
+        edges = dict((c._id, c) for c in circle_commits)
+        children = repository._children_in(layout)
+        for commit in circle_commits:
+            for child in children.get(commit._id, ()):
+                edges[child._id] = child
+        edge_commits = sorted(edges.values(), key=order)
+
+        drawing = repository._drawing(False, layout, active, cached=False)
+        added = []
+        changed = []
+        removed = []
+        for kind, format_kind, commits, record, drawn in (
+                ("edges", "edges", edge_commits, drawing.edge_record, old.edges),
+                ("commit", "circles", circle_commits, drawing.circle_record, old.circles)):
+            texts = _format(drawing.mode, format_kind, [record(c) for c in commits])
+            for commit, svg in zip(commits, texts):
+                _compare(kind, commit, svg, drawn, added, changed, removed)
+                drawn[commit._id] = svg
+        self._fragments = _Fragments(layout, None, active, old.edges, old.circles, None)
+        return added, changed, removed
+
+    def write_frames(self, out):
+        """ Write the frames to out as json, one frame per line. """
+        binary = _is_binary(out)
+        for number, frame in enumerate(self._frames):
+            line = json.dumps(collections.OrderedDict([
+                ("frame", number),
+                ("label", frame.label),
+                ("height", 60 * (frame.height + 1)),
+                ("width", 60 * (frame.width + 1)),
+                ("added", frame.added),
+                ("changed", frame.changed),
+                ("removed", frame.removed),
+            ])) + "\n"
+            out.write(line.encode("utf-8") if binary else line)
+
+    def render(self, out=None, seconds=1):
+        """ Write the frames to out as one svg animated with SMIL.
+
+        Each version of an element is written once and shown from the frame
+        it was drawn for until the frame that changes or removes it. A frame
+        lasts the given number of seconds and the last one stays up.
+        """
+        if out is None:
+            out = sys.stdout
+        writer = XmlWriter(out)
+        frames = self._frames
+        writer.write(Repository.SVG_START % (60 * (max(f.height for f in frames) + 1),
+                                             60 * (max(f.width for f in frames) + 1)))
+        versions = []
+        shown = {}
+        for number, frame in enumerate(frames):
+            for name, svg in itertools.chain(frame.added, frame.changed):
+                if name in shown:
+                    shown[name][3] = number
+                shown[name] = version = [name, svg, number, None]
+                versions.append(version)
+            for name in frame.removed:
+                version = shown.pop(name, None)
+                if version is not None:
+                    version[3] = number
+
+        # Edges go underneath every commit, as they do in a single render.
+        for edges in (True, False):
+            for name, svg, start, end in versions:
+                if name.startswith("edges-") != edges:
+                    continue
+                writer.write('<g display="none">')
+                writer.write(svg)
+                writer.write('<set attributeName="display" to="inline" begin="%ss"/>'
+                             % (start * seconds))
+                if end is not None:
+                    writer.write('<set attributeName="display" to="none" begin="%ss"/>'
+                                 % (end * seconds))
+                writer.write("</g>")
+        writer.end("svg")
+        writer.flush()
+
+
+# A snapshot is this magic, the length of a json header as 8 bytes little
+# endian, the header padded to 8 bytes and then the columns it lists. Those
+# are little endian int32 arrays and one blob of utf-8 text.
+_SNAPSHOT_MAGIC = b"simgit\x00\x01"
+
+_SNAPSHOT_COLUMNS = (
+    "ids", "generations", "branch_nums", "colors", "messages", "sha1s",
+    "changes", "revisions", "lineages",
+    "parents_start", "parents", "ancestors_start", "ancestors",
+    "replaces_start", "replaces", "strings_start",
+)
+
+
+def _encode(text):
+    return text if isinstance(text, bytes) else text.encode("utf-8")
+
+
+_code = []
+
+
+def _code_digest():
+    # What is drawn changes with this module, so renders are only reused by
+    # the same code as made them.
+    if not _code:
+        with open(os.path.splitext(__file__)[0] + ".py", "rb") as source:
+            _code.append(hashlib.sha1(source.read()).digest())
+    return _code[0]
+
+
+def _native(text):
+    # Give back the str of this python, whatever json or a slice gave.
+    if isinstance(text, str):
+        return text
+    if isinstance(text, bytes):
+        return text.decode("utf-8")
+    return text.encode("utf-8")
+
+
+def _int32s(data):
+    column = array.array("i")
+    if hasattr(column, "frombytes"):
+        column.frombytes(data)
+    else:
+        column.fromstring(data)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column
+
+
+def _int32s_bytes(column):
+    if sys.byteorder == "big":
+        column = array.array("i", column)
+        column.byteswap()
+    return column.tobytes() if hasattr(column, "tobytes") else column.tostring()
+
+
+_int32_views = (sys.byteorder == "little" and hasattr(memoryview, "cast")
+                and array.array("i").itemsize == 4)
+
+
+class _Snapshot(object):
+    """ A saved repository, mapped into memory. Each column is read when it
+    is first wanted, and strings one at a time.
+    """
+    def __init__(self, mapped, start, header):
+        self._mapped = mapped
+        self._start = start
+        self._text = start + header["columns"]["text"][0]
+        self._lineages = {}
+        self.header = header
+        self.columns = _Columns(self)
+        self.colors = [Color.FromString(_native(c)) for c in header["colors"]]
+        # The rows of each change by its first, once one is wanted.
+        self.changes = None
+
+    def column(self, name):
+        offset, count = self.header["columns"][name]
+        start = self._start + offset
+        if _int32_views:
+            # Straight from the file, which is little endian like this.
+            return memoryview(self._mapped)[start:start + count * 4].cast("i")
+        return _int32s(self._mapped[start:start + count * 4])
+
+    def string(self, index):
+        starts = self.columns["strings_start"]
+        return _native(self._mapped[self._text + starts[index]:self._text + starts[index + 1]])
+
+    def text(self):
+        count = self.header["columns"]["text"][1]
+        return self._mapped[self._text:self._text + count]
+
+    def lineage(self, index):
+        # Lineages are mostly alike, so each is only parsed once.
+        lineage = self._lineages.get(index)
+        if lineage is None:
+            lineage = self._lineages[index] = int(self.string(index), 16)
+        return lineage
+
+    def close(self):
+        for column in self.columns.values():
+            if isinstance(column, memoryview):
+                column.release()
+        self.columns.clear()
+        try:
+            self._mapped.close()
+        except BufferError:
+            # A view is still held somewhere, say by a traceback. The file
+            # is unmapped once that goes.
+            pass
+
+
+class _Columns(dict):
+    # A snapshot's columns by name, each read the first time it is wanted.
+    def __init__(self, snapshot):
+        dict.__init__(self)
+        self._snapshot = snapshot
+
+    def __missing__(self, name):
+        column = self[name] = self._snapshot.column(name)
+        return column
+
+
+def _unread(name):
+    # A slot of _LoadedCommit, which reads the commit in first.
+    slot = Commit.__dict__[name]
+
+    def get(commit):
+        commit._repository._read(commit)
+        return slot.__get__(commit, Commit)
+
+    def set(commit, value):
+        commit._repository._read(commit)
+        slot.__set__(commit, value)
+    return property(get, set)
+
+
+class _LoadedCommit(Commit):
+    """ A commit of a loaded snapshot which only has its own row so far.
+
+    Its parents, ancestors, replaces and change are read from the snapshot
+    the first time any of them is used, and then it is a plain Commit. Till
+    then its _parents slot holds its row.
+    """
+    __slots__ = ()
+    _parents = _unread("_parents")
+    _sorted_parents = _unread("_sorted_parents")
+    _ancestors = _unread("_ancestors")
+    _replaces = _unread("_replaces")
+    _change = _unread("_change")
+
+
+_UNREAD = object()
+_row_slot = Commit.__dict__["_parents"]
+_change_slot = Commit.__dict__["_change"]
+_pointer_slots = [(name, Commit.__dict__["_" + name])
+                  for name in ("parents", "ancestors", "replaces")]
+
+
+# Colours for branches imported from git, handed out in turn.
+_GIT_COLORS = (
+    "#808080", "#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd",
+    "#8c564b", "#e377c2", "#bcbd22", "#17becf",
+)
+
+
+def _git_lines(path, args):
+    """ Run git in path and give its output a line at a time. """
+    process = subprocess.Popen(["git"] + list(args), cwd=path,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        for line in process.stdout:
+            yield _native(line.rstrip(b"\n").decode("utf-8", "replace"))
+    finally:
+        process.stdout.close()
+        errors = process.stderr.read()
+        process.stderr.close()
+        # Stopped early, git may still be writing. It's not wanted anymore.
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+    if process.returncode:
+        raise Exception("git %s failed: %s" % (" ".join(args), _native(
+            errors.decode("utf-8", "replace")).strip()))
+
+
+def _git_refs(path):
+    # Every local branch, the one checked out first.
+    refs = list(_git_lines(path, ["for-each-ref", "--format=%(refname:short)", "refs/heads"]))
+    current = list(_git_lines(path, ["rev-parse", "--abbrev-ref", "HEAD"]))
+    if current and current[0] in refs:
+        refs.remove(current[0])
+        refs.insert(0, current[0])
+    return refs
+
+
 class Repository(object):
-    def __init__(self):
+    def __init__(self, bitmaps=False, seed="", stats=None, render_cache=None):
         self._branches = collections.OrderedDict()
+        self._ids = IdAllocator(seed)
+        self._reachability = ReachabilityIndex() if bitmaps else None
+        # Commits made or changed since the last layout, by id, and whether
+        # any change was more than the next layout can carry on from. The
+        # first column each commit could go in is kept between layouts.
+        self._dirty = {}
+        self._reshaped = False
+        # The children of every commit of a layout, by its serial.
+        self._children = None
+        self._asap = array.array("i")
+        self._layout = None
+        self._layout_lock = threading.Lock()
+        # The last render's fragments, one set per mode.
+        self._fragments = {}
+        self._fragments_lock = threading.Lock()
+        # Branch operations in progress, and who wants to hear of the end.
+        self._operations = 0
+        self._recorders = []
+        self._stats = Stats() if stats is True else stats or None
+        # A loaded snapshot with commits not read yet, its commits by row as
+        # they are made, and how many rows are still to read.
+        self._snapshot = None
+        self._snapshot_lock = threading.Lock()
+        self._rows = None
+        self._unread = 0
+        # Since the last fork, commits with ids below _frozen are shared,
+        # bar the copies in _owned, and _referrers has the commits of this
+        # repository alone which point to shared ones, by their ids.
+        self._shared = None
+        self._frozen = 0
+        self._owned = {}
+        self._referrers = {}
+        # Changes are copied on write the same way. _changes has the copies
+        # by the shared Change, or by the commit if it had none, and _numbers
+        # the revision and lineage of shared commits that have been
+        # renumbered. Only Changes with _change_owner as their owner are
+        # this repository's to change.
+        self._changes = {}
+        self._numbers = {}
+        self._change_owner = None
+        self._forks = 0
+        self._asap_shared = False
+        # Commit digests from before the last change of the epoch are out
+        # of date. _digest_marks flags, by id, the commits of this one that
+        # are folded into another's digest.
+        self._digest_epoch = 0
+        self._digest_marks = None
+        self._render_cache = render_cache
+
+    @property
+    def branches(self):
+        """ The branches by name, in the order they were made. """
+        return collections.OrderedDict(self._branches)
+
+    @property
+    def stats(self):
+        """ The Stats being kept, or None when they're off, as by default.
+
+        Pass stats=True, or a Stats to share, to Repository to turn them
+        on, or set this. Off, they cost next to nothing.
+        """
+        return self._stats
+
+    @stats.setter
+    def stats(self, stats):
+        self._stats = Stats() if stats is True else stats or None
+
+    @property
+    def render_cache(self):
+        """ The RenderCache render uses, or None, as by default. """
+        return self._render_cache
+
+    @render_cache.setter
+    def render_cache(self, render_cache):
+        self._render_cache = render_cache
+
+    def _phases(self, prefix):
+        stats = self._stats
+        return stats.phases(prefix) if stats is not None else NO_PHASES
+
+    @property
+    def ids(self):
+        return self._ids
+
+    @property
+    def reachability(self):
+        """ The ReachabilityIndex if bitmaps were enabled, otherwise None. """
+        return self._reachability
+
+    def _touch(self, commit, columns=False, walk=False):
+        """ Note that commit is new or changed so the layout is out of date.
+
+        columns is for a change to its replaces, which can move everything
+        after it, so every column has to be worked out again. walk is for
+        any other change to what walking the history comes to, after which
+        the history has to be walked again from the start.
+        """
+        self._dirty[commit._id] = commit
+        if columns or walk:
+            self._reshaped = True
+        if columns:
+            self._asap = array.array("i")
+            self._asap_shared = False
+
+    def fork(self, seed=None):
+        """ A copy of the repository to take another way from here.
+
+        Commits and changes are shared and copied on write, so a fork only
+        costs what it does differently. New commits get sha1s from seed, by
+        default this one's with the number of the fork. Stats are shared.
+        """
+        branches = self._branches
+        self._forks += 1
+        if seed is None:
+            seed = "%s/%d" % (self._ids.seed, self._forks)
+        heads = [b.head for b in branches.values() if b.head is not None]
+        shared = self._shared
+        if (shared is None or self._ids.count != self._frozen or self._owned
+                or len(heads) != len(shared.heads)
+                or any(a is not b for a, b in zip(heads, shared.heads))):
+            shared = self._freeze(_SharedHistory(heads, self._ids.count))
+
+        fork = Repository(seed=seed, stats=self._stats, render_cache=self._render_cache)
+        fork._freeze(shared)
+        fork._changes = dict(self._changes)
+        fork._numbers = dict(self._numbers)
+        # The Changes made here so far are the fork's as much as this one's.
+        self._change_owner = object()
+        fork._ids._commits = self._ids.count
+        fork._ids._branches = self._ids._branches
+        if self._reachability is not None:
+            fork._reachability = self._reachability.copy()
+        mine = fork._branches
+        for name, branch in branches.items():
+            copy = Branch.__new__(Branch)
+            copy.__dict__.update(branch.__dict__)
+            copy._repository = fork
+            mine[name] = copy
+        for copy in mine.values():
+            copy._downstreams = set(mine[b.name] for b in copy._downstreams)
+        with self._layout_lock:
+            # An out of date layout is no use, the fork places afresh.
+            if not self._dirty:
+                fork._layout = self._layout
+            fork._asap = self._asap
+            self._asap_shared = fork._asap_shared = True
+        return fork
+
+    def _freeze(self, shared):
+        self._shared = shared
+        self._frozen = shared._size
+        self._owned = {}
+        self._referrers = {}
+        self._change_owner = object()
+        return shared
+
+    def _writable(self, commit):
+        # Whether commit is this repository's alone, to change in place.
+        return commit._repository is self and (
+            commit._id >= self._frozen or self._owned.get(commit._id) is commit)
+
+    def _check_writable(self, commit):
+        if not commit._repository._writable(commit):
+            raise Exception("Commit %s is shared with a fork, change it through a branch"
+                            % commit.sha1)
+
+    def _change_of(self, commit, create=True):
+        """ The Change of commit as this repository has it.
+
+        Made if commit hasn't got one and create is set, otherwise None.
+        Shared commits keep pointing to the Changes they had when they were
+        frozen, so after a fork the copies this repository made of those
+        are looked up from them, and from commits without one.
+        """
+        change = commit._change
+        if self._shared is None:
+            if change is None:
+                if not create:
+                    return None
+                change = commit._change = Change(commit)
+                return change
+            return change.find()
+        if change is None:
+            change = self._changes.get(commit)
+            if change is None:
+                if not create:
+                    return None
+                change = Change(commit, self._change_owner)
+                if self._writable(commit):
+                    commit._change = change
+                else:
+                    self._changes[commit] = change
+                return change
+        change = change.find()
+        while change._owner is not self._change_owner:
+            copy = self._changes.get(change)
+            if copy is None:
+                break
+            change = copy.find()
+        return change
+
+    def _own_change(self, commit):
+        """ The Change of commit to change in place, copied if it is shared.
+
+        The copy has the same revisions, or the copies of them this
+        repository changes in their place.
+        """
+        change = self._change_of(commit)
+        if self._shared is None or change._owner is self._change_owner:
+            return change
+        owned = self._owned
+        copy = Change.__new__(Change)
+        copy._parent = copy
+        copy._revisions = [owned.get(c._id, c) for c in change._revisions]
+        copy._owner = self._change_owner
+        self._changes[change] = copy
+        return copy
+
+    def _numbering(self, commit):
+        # The revision and lineage of commit as this repository has them.
+        if self._shared is not None:
+            numbering = self._numbers.get(commit)
+            if numbering is not None:
+                return numbering
+        return commit._revision, commit._lineage
+
+    def _number(self, commit, revision, lineage):
+        # Set them, aside for a shared commit.
+        if self._shared is None or self._writable(commit):
+            commit._revision = revision
+            commit._lineage = lineage
+        else:
+            self._numbers[commit] = (revision, lineage)
+
+    def _renumber(self, commit, offset):
+        revision, lineage = self._numbering(commit)
+        self._number(commit, revision + offset, lineage << offset)
+
+    def _union(self, commit, other):
+        """ Join the changes of commit and other, copying them if shared. """
+        change = self._own_change(commit)
+        return change.union(self._own_change(other),
+                            self._renumber if self._shared is not None else None)
+
+    def _supersedes(self, commit, other):
+        """ Whether other is an older revision of commit's change, here. """
+        if commit is other:
+            return False
+        change = self._change_of(commit, False)
+        if change is None or self._change_of(other, False) is not change:
+            return False
+        return bool(self._numbering(commit)[1] >> self._numbering(other)[0] & 1)
+
+    def _note_referrer(self, commit, pointees):
+        for pointee in pointees:
+            if not self._writable(pointee):
+                self._referrers.setdefault(pointee._id, []).append(commit)
+
+    def _own(self, commit):
+        """ The commit to change in place for commit, copied if it is shared.
+
+        Everything pointing to the copied commit has to point to the copy,
+        so shared commits doing so are copied too, and so on. Commits of
+        this repository alone, and branch heads, are just pointed over.
+        """
+        if commit is None or self._writable(commit):
+            return commit
+        copies = collections.OrderedDict()
+        pending = [commit]
+        while pending:
+            shared = pending.pop()
+            if shared in copies:
+                continue
+            copies[shared] = copy = shared._copy(self)
+            self._owned[shared._id] = copy
+            for referrer in self._shared.referrers(shared):
+                if referrer._id not in self._owned:
+                    pending.append(referrer)
+
+        def repoint(commit):
+            for slot in ("_parents", "_sorted_parents", "_ancestors", "_replaces"):
+                pointees = getattr(commit, slot)
+                if any(p in copies for p in pointees):
+                    setattr(commit, slot, tuple(copies.get(p, p) for p in pointees))
+        for shared, copy in copies.items():
+            repoint(copy)
+            self._touch(copy, walk=True)
+            # The copy takes the shared commit's place among the revisions.
+            copy._revision, copy._lineage = self._numbering(shared)
+            if copy._change is not None or shared in self._changes:
+                change = self._own_change(shared)
+                change._revisions[copy._revision] = copy
+                copy._change = change
+        for shared in copies:
+            for referrer in self._referrers.pop(shared._id, ()):
+                repoint(referrer)
+                # Its digest was made from the shared commit, which the
+                # copy will differ from.
+                self._unhash(referrer)
+        for copy in copies.values():
+            self._note_referrer(copy, itertools.chain(
+                copy._parents, copy._ancestors, copy._replaces))
+        for branch in self._branches.values():
+            copy = copies.get(branch._head)
+            if copy is not None:
+                if self._reachability is not None:
+                    self._reachability.replaced(branch._head, copy)
+                branch._head = copy
+        return copies[commit]
+
+    def _mark_hashed(self, commit):
+        marks = self._digest_marks
+        if marks is None or commit._id >= len(marks):
+            grown = bytearray(self._ids.count)
+            if marks is not None:
+                grown[:len(marks)] = marks
+            self._digest_marks = marks = grown
+        marks[commit._id] = 1
+
+    def _unhash(self, commit):
+        """ Forget commit's digest, it is about to change.
+
+        Telling which digests folded it in would take pointers from commits
+        to their children, so if any did every digest goes instead.
+        """
+        marks = self._digest_marks
+        if marks is not None and commit._id < len(marks) and marks[commit._id]:
+            self._digest_epoch += 1
+            self._digest_marks = None
+        commit._digest = None
+
+    @property
+    def state_hash(self):
+        """ A Merkle hash of the history, as hex.
+
+        It covers the name of every branch with the structural hash of its
+        head, see Commit.structural_hash, so histories which are the same
+        but for sha1s and colours hash the same. Only commits made or
+        changed since it was last asked for have to be hashed.
+        """
+        self._read_all()
+        digest = hashlib.sha1()
+        for name, branch in sorted(self._branches.items()):
+            digest.update(_encode(name) + b"\0")
+            if branch._head is not None:
+                digest.update(_digest(branch._head)[1][:20])
+        return digest.hexdigest()
+
+    def _render_key(self, active_branches, compact, compress):
+        # All a render depends on: the code, the history as drawn, with the
+        # branches in their order, and the options.
+        digest = hashlib.sha1(_code_digest())
+        for name, branch in self._branches.items():
+            digest.update(_encode("%s\0%d\0" % (name, branch.num)))
+            if branch._head is not None:
+                digest.update(_digest(branch._head)[1][20:])
+        digest.update(b"active")
+        heads = [b.commitish() for b in active_branches or ()]
+        for look in sorted(_digest(head)[1][20:] for head in heads if head is not None):
+            digest.update(look)
+        digest.update(_encode("%d %d" % (bool(compact), bool(compress))))
+        return digest.hexdigest()
+
+    def _touch_many(self, commits):
+        dirty = self._dirty
+        for commit in commits:
+            dirty[commit._id] = commit
+
+    def _head_moved(self, old, new):
+        if self._reachability is not None:
+            self._reachability.head_moved(old, new)
+        for commit in (old, new):
+            if commit is not None:
+                self._touch(commit)
+
+    def _operation_done(self, branch, operation):
+        for recorder in list(self._recorders):
+            recorder.frame("%s %s" % (branch.name, operation))
+
+    @contextlib.contextmanager
+    def record(self, active_branches=None):
+        """ Record a frame of the history after every branch operation.
+
+        Use as a context manager. It gives the Recorder, which can take extra
+        frames and write out what was recorded.
+        """
+        recorder = Recorder(self, active_branches)
+        recorder.frame("start")
+        self._recorders.append(recorder)
+        try:
+            yield recorder
+        finally:
+            self._recorders.remove(recorder)
 
     def branch(self, name, head=None, color=None):
         if name in self._branches:
@@ -531,120 +2436,1294 @@ class Repository(object):
                    name=name,
                    color=color)
         self._branches[name] = b
+        self._head_moved(None, b.commitish())
         return b
 
-    def place(self):
-        grid = collections.defaultdict(
-            lambda: collections.defaultdict(
-                lambda: None))
+    def build_from_spec(self, spec):
+        """ Build history from spec, a list of steps, and return the branches.
+
+        Each step is a dict, one of:
+
+          {"branch": name, "from": other, "color": color}
+              Make a branch, at the head of branch other if given. The
+              colour is other's, or grey, unless given.
+          {"commit": name, "count": n, "message": "Change %d"}
+              Make n commits, one by default, on branch name. The message
+              is formatted with the number of commits the spec has made so
+              far. Or "messages" can list them.
+          {"merge": other, "into": name, "message": message}
+              Merge branch other, or a list of them, into branch name.
+        """
+        branches = self._branches
+        made = 0
+        for step in spec:
+            if "branch" in step:
+                if step.get("from") is not None:
+                    branches[step["from"]].branch(step["branch"], color=step.get("color"))
+                else:
+                    self.branch(step["branch"], color=step.get("color", "#808080"))
+            elif "commit" in step:
+                messages = step.get("messages")
+                if messages is None:
+                    template = step.get("message", "Change %d")
+                    messages = [template % n for n in range(made, made + step.get("count", 1))]
+                made += len(branches[step["commit"]].commit_many(messages))
+            elif "merge" in step:
+                others = step["merge"]
+                if isinstance(others, (list, tuple)):
+                    others = [branches[other] for other in others]
+                else:
+                    others = branches[others]
+                branches[step["into"]].merge(others, step.get("message"))
+            else:
+                raise Exception("Unknown step in spec: %r" % (step,))
+        return self.branches
+
+    def _saved_commits(self):
+        # Everything reachable from a branch any way at all.
+        self._read_all()
+        seen = bytearray(self._ids.count)
+        stack = [b.commitish() for b in self._branches.values() if b.commitish() is not None]
+        commits = []
+        while stack:
+            commit = stack.pop()
+            if seen[commit._id]:
+                continue
+            seen[commit._id] = 1
+            commits.append(commit)
+            stack.extend(commit._parents)
+            stack.extend(commit._ancestors)
+            stack.extend(commit._replaces)
+        commits.sort(key=lambda c: c._id)
+        return commits
+
+    def _saved_revisions(self, commits):
+        # Revisions of a change can be dropped, so number those saved
+        # afresh, and their lineages to match. Gives each commit's row of
+        # the first revision, revision and lineage.
+        changes = collections.OrderedDict()
+        for row, commit in enumerate(commits):
+            change = self._change_of(commit, False)
+            if change is not None:
+                changes.setdefault(change, []).append((self._numbering(commit)[0], row))
+        saved = [(-1, 0, 1)] * len(commits)
+        for revisions in changes.values():
+            revisions.sort()
+            first = revisions[0][1]
+            for number, (revision, row) in enumerate(revisions):
+                lineage = self._numbering(commits[row])[1]
+                renumbered = 0
+                for older, (old, _) in enumerate(revisions[:number + 1]):
+                    if lineage >> old & 1:
+                        renumbered |= 1 << older
+                saved[row] = (first, number, renumbered)
+        return saved
+
+    def save(self, path):
+        """ Save the repository to path, to get back with Repository.load.
+
+        The file is binary and columnar with a json header. Commits no branch
+        can reach are dropped. Layouts and stats aren't saved.
+        """
+        commits = self._saved_commits()
+        revisions = self._saved_revisions(commits)
+        rows = array.array("i", [-1]) * self._ids.count
+        for row, commit in enumerate(commits):
+            rows[commit._id] = row
+
+        strings = {}
+        def string(text):
+            if text is None:
+                return -1
+            index = strings.get(text)
+            if index is None:
+                index = strings[text] = len(strings)
+            return index
+        # One entry per Color, not per colour: python 2 tells them apart
+        # by identity when drawing, as Color has no __ne__.
+        colors = {}
+        palette = []
+        def color(c):
+            index = colors.get(id(c))
+            if index is None:
+                index = colors[id(c)] = len(palette)
+                palette.append(str(c))
+            return index
+
+        columns = collections.OrderedDict(
+            (name, array.array("i")) for name in _SNAPSHOT_COLUMNS)
+        for name in ("parents_start", "ancestors_start", "replaces_start"):
+            columns[name].append(0)
+        sha1 = self._ids.sha1
+        for commit, (change, revision, lineage) in zip(commits, revisions):
+            columns["ids"].append(commit._id)
+            columns["generations"].append(commit._generation)
+            columns["branch_nums"].append(commit._branch_num)
+            columns["colors"].append(color(commit._color))
+            columns["messages"].append(string(commit._message))
+            # Only keep sha1s that can't be made again from the id. Commits
+            # shared with the repository this was forked from can't.
+            if commit._repository is not self:
+                given = commit.sha1
+            else:
+                given = commit._sha1
+                if given is not None and given == sha1(commit._id):
+                    given = None
+            columns["sha1s"].append(string(given))
+            columns["changes"].append(change)
+            columns["revisions"].append(revision)
+            columns["lineages"].append(string("%x" % lineage))
+            for name in ("parents", "ancestors", "replaces"):
+                column = columns[name]
+                column.extend(rows[c._id] for c in getattr(commit, "_" + name))
+                columns[name + "_start"].append(len(column))
+
+        texts = [None] * len(strings)
+        for text, index in strings.items():
+            texts[index] = _encode(text)
+        offset = 0
+        for text in texts:
+            columns["strings_start"].append(offset)
+            offset += len(text)
+        columns["strings_start"].append(offset)
+        blobs = [_int32s_bytes(column) for column in columns.values()]
+        blobs.append(b"".join(texts))
+
+        places = collections.OrderedDict()
+        offset = 0
+        for name, blob in zip(list(columns) + ["text"], blobs):
+            places[name] = [offset, len(blob) // (1 if name == "text" else 4)]
+            offset += -len(blob) % 8 + len(blob)
+        header = collections.OrderedDict([
+            ("seed", self._ids.seed),
+            ("ids", self._ids.count),
+            ("branch_nums", self._ids._branches),
+            ("bitmaps", self._reachability is not None),
+            ("branches", [collections.OrderedDict([
+                ("name", branch.name),
+                ("num", branch.num),
+                ("color", color(branch.color)),
+                ("head", rows[branch.head._id] if branch.head is not None else -1),
+                ("downstreams", sorted(b.name for b in branch._downstreams)),
+            ]) for branch in self._branches.values()]),
+            ("colors", palette),
+            ("columns", places),
+        ])
+        header = json.dumps(header).encode("utf-8")
+        header += b" " * (-len(header) % 8)
+
+        with open(path, "wb") as out:
+            out.write(_SNAPSHOT_MAGIC)
+            out.write(struct.pack("<Q", len(header)))
+            out.write(header)
+            for blob in blobs:
+                out.write(blob)
+                out.write(b"\0" * (-len(blob) % 8))
+
+    @classmethod
+    def load(cls, path, stats=None):
+        """ Load a repository saved by save.
+
+        The file is mapped and each commit read from it the first time anything
+        goes past it, so opening takes next to no time. Walking the whole
+        history reads the rest at once. Don't write to the file till then.
+        """
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if mapped[:len(_SNAPSHOT_MAGIC)] != _SNAPSHOT_MAGIC:
+                raise Exception("%s isn't a simgit snapshot" % path)
+            start = len(_SNAPSHOT_MAGIC) + 8
+            size, = struct.unpack("<Q", mapped[len(_SNAPSHOT_MAGIC):start])
+            header = json.loads(mapped[start:start + size].decode("utf-8"))
+        except Exception:
+            mapped.close()
+            raise
+
+        repository = cls(bitmaps=header["bitmaps"], seed=_native(header["seed"]), stats=stats)
+        snapshot = repository._snapshot = _Snapshot(mapped, start + size, header)
+        rows = header["columns"]["ids"][1]
+        repository._rows = [None] * rows
+        repository._unread = rows
+        repository._ids._commits = header["ids"]
+
+        branches = repository._branches
+        for saved in header["branches"]:
+            head = repository._loaded(saved["head"]) if saved["head"] >= 0 else None
+            branch = Branch(repository=repository, head=head, name=_native(saved["name"]),
+                            color=snapshot.colors[saved["color"]])
+            branch._num = saved["num"]
+            branches[branch.name] = branch
+            repository._head_moved(None, head)
+        for saved in header["branches"]:
+            branches[_native(saved["name"])]._downstreams.update(
+                branches[_native(name)] for name in saved["downstreams"])
+        # Making the branches again took numbers of their own.
+        repository._ids._branches = header["branch_nums"]
+        if not rows:
+            snapshot.close()
+            repository._snapshot = repository._rows = None
+        return repository
+
+    def _loaded(self, row):
+        # The commit of the snapshot's row, made bare the first time.
+        commit = self._rows[row]
+        if commit is not None:
+            return commit
+        snapshot = self._snapshot
+        columns = snapshot.columns
+        commit = _LoadedCommit.__new__(_LoadedCommit)
+        _row_slot.__set__(commit, row)
+        _change_slot.__set__(commit, _UNREAD)
+        commit._id = columns["ids"][row]
+        commit._repository = self
+        commit._generation = columns["generations"][row]
+        commit._branch_num = columns["branch_nums"][row]
+        commit._color = snapshot.colors[columns["colors"][row]]
+        message = columns["messages"][row]
+        commit._message = _intern(snapshot.string(message)) if message >= 0 else None
+        sha1 = columns["sha1s"][row]
+        commit._sha1 = snapshot.string(sha1) if sha1 >= 0 else None
+        commit._digest = None
+        commit._revision = columns["revisions"][row]
+        commit._lineage = snapshot.lineage(columns["lineages"][row])
+        self._rows[row] = commit
+        return commit
+
+    def _read(self, commit):
+        # Read in the rest of commit, a _LoadedCommit, from the snapshot.
+        with self._snapshot_lock:
+            if type(commit) is not _LoadedCommit:
+                # Another thread read it first.
+                return
+            self._read_row(commit)
+            commit.__class__ = Commit
+            self._unread -= 1
+            if not self._unread:
+                self._snapshot.close()
+                self._snapshot = self._rows = None
+
+    def _read_all(self):
+        # Walking the whole history reads everything still unread in one go,
+        # which is quicker than a commit at a time.
+        with self._snapshot_lock:
+            snapshot = self._snapshot
+            if snapshot is None:
+                return
+            try:
+                with _gc_paused():
+                    self._read_rest(snapshot)
+            finally:
+                snapshot.close()
+                self._snapshot = self._rows = None
+                self._unread = 0
+
+    def _read_rest(self, snapshot):
+        # What _loaded and _read_row do, for every row not read yet.
+        columns = snapshot.columns
+        starts = columns["strings_start"]
+        text = snapshot.text()
+        def string(index):
+            return _native(text[starts[index]:starts[index + 1]])
+        colors = snapshot.colors
+        lineage = snapshot.lineage
+
+        commits = self._rows
+        unread = bytearray(len(commits))
+        new = Commit.__new__
+        for row, commit, commit_id, generation, num, color, message, sha1, revision, \
+                line in zip(itertools.count(), commits, columns["ids"], columns["generations"],
+                            columns["branch_nums"], columns["colors"], columns["messages"],
+                            columns["sha1s"], columns["revisions"], columns["lineages"]):
+            if commit is not None:
+                if type(commit) is _LoadedCommit:
+                    unread[row] = 1
+                    commit.__class__ = Commit
+                continue
+            commits[row] = commit = new(Commit)
+            unread[row] = 1
+            commit._id = commit_id
+            commit._repository = self
+            commit._generation = generation
+            commit._branch_num = num
+            commit._color = colors[color]
+            commit._message = _intern(string(message)) if message >= 0 else None
+            commit._sha1 = string(sha1) if sha1 >= 0 else None
+            commit._change = _UNREAD
+            commit._digest = None
+            commit._revision = revision
+            commit._lineage = lineage(line)
+
+        empty = ()
+        for name, slot in _pointer_slots:
+            pointees = columns[name]
+            ends = itertools.islice(columns[name + "_start"], 1, None)
+            start = 0
+            for commit, end, read in zip(commits, ends, unread):
+                if read:
+                    if end == start:
+                        pointers = empty
+                    elif end == start + 1:
+                        pointers = (commits[pointees[start]],)
+                    else:
+                        pointers = tuple(commits[row] for row in pointees[start:end])
+                    slot.__set__(commit, pointers)
+                start = end
+        changes = {}
+        for commit, change, read in zip(commits, columns["changes"], unread):
+            if not read:
+                continue
+            parents = commit._parents
+            if len(parents) > 1:
+                commit._sorted_parents = tuple(sorted(parents, key=lambda c: c._branch_num))
+            else:
+                commit._sorted_parents = parents
+            if commit._change is not _UNREAD:
+                continue
+            if change < 0:
+                commit._change = None
+            else:
+                changes.setdefault(change, []).append(commit)
+
+        # A change is given to all of its revisions at once, so these are
+        # all of theirs.
+        for revisions in changes.values():
+            revisions.sort(key=lambda c: c._revision)
+            change = Change(revisions[0])
+            change._revisions = revisions
+            for commit in revisions:
+                commit._change = change
+
+    def _read_row(self, commit):
+        snapshot = self._snapshot
+        columns = snapshot.columns
+        row = _row_slot.__get__(commit, Commit)
+        loaded = self._loaded
+        empty = ()
+        for name, slot in _pointer_slots:
+            starts = columns[name + "_start"]
+            start, end = starts[row], starts[row + 1]
+            if end == start:
+                pointers = empty
+            elif end == start + 1:
+                pointers = (loaded(columns[name][start]),)
+            else:
+                pointers = tuple(loaded(r) for r in columns[name][start:end])
+            slot.__set__(commit, pointers)
+        parents = _row_slot.__get__(commit, Commit)
+        if len(parents) > 1:
+            parents = tuple(sorted(parents, key=lambda c: c._branch_num))
+        Commit.__dict__["_sorted_parents"].__set__(commit, parents)
+
+        if _change_slot.__get__(commit, Commit) is not _UNREAD:
+            return
+        first = columns["changes"][row]
+        if first < 0:
+            _change_slot.__set__(commit, None)
+            return
+        # Every revision of the change gets it now, read or not.
+        changes = snapshot.changes
+        if changes is None:
+            changes = snapshot.changes = {}
+            for other, change in enumerate(columns["changes"]):
+                if change >= 0:
+                    changes.setdefault(change, []).append(other)
+        rows = changes.pop(first)
+        revisions = columns["revisions"]
+        rows.sort(key=lambda r: revisions[r])
+        change = Change(loaded(rows[0]))
+        change._revisions = [loaded(r) for r in rows]
+        for revision in change._revisions:
+            _change_slot.__set__(revision, change)
 
-        # First place the branches in lanes. This traversal doesn't follow
-        # replaces pointers as part of DFS because I want obsoleted branches to
-        # appear below active branches.
-        lane = 1
+    @classmethod
+    def from_git(cls, path, refs=None, stats=None):
+        """ Import the history of refs from the git repository at path.
+
+        refs default to every local branch, the checked out one first. Each is
+        a branch, commits keep their sha1s and subjects, and merged topics get
+        lanes of their own. git's output is streamed twice, keeping only a lane
+        per commit between. Parents git leaves out are skipped.
+        """
+        if refs is None:
+            refs = _git_refs(path)
+        refs = list(collections.OrderedDict.fromkeys(refs))
+        tips = list(_git_lines(path, ["rev-parse"] + ["%s^{commit}" % ref for ref in refs]))
+
+        # Lane numbers: refs first, so lower numbers win, then the merged
+        # topics as they turn up.
+        lanes = {}
+        for lane, tip in reversed(list(enumerate(tips))):
+            lanes[tip] = lane
+        topics = len(refs)
+        for line in _git_lines(path, ["rev-list", "--topo-order", "--parents"] + tips):
+            shas = line.split(" ")
+            lane = lanes.get(shas[0])
+            if lane is None:
+                lane = lanes[shas[0]] = topics
+                topics += 1
+            if len(shas) > 1:
+                first = lanes.get(shas[1])
+                if first is None or first > lane:
+                    lanes[shas[1]] = lane
+            for parent in shas[2:]:
+                if parent not in lanes:
+                    lanes[parent] = topics
+                    topics += 1
+
+        repository = cls(stats=stats)
+        branches = [repository.branch(ref, color=_GIT_COLORS[n % len(_GIT_COLORS)])
+                    for n, ref in enumerate(refs)]
+        topic_branches = {}
+        commits = {}
+        for line in _git_lines(path, ["log", "--topo-order", "--reverse",
+                                      "--format=%H %P%x09%s"] + tips):
+            shas, _, message = line.partition("\t")
+            shas = shas.split(" ")
+            sha1 = shas[0]
+            lane = lanes.pop(sha1)
+            if lane < len(branches):
+                branch = branches[lane]
+            else:
+                branch = topic_branches.get(lane)
+                if branch is None:
+                    branch = topic_branches[lane] = Branch(
+                        repository, None, None, _GIT_COLORS[lane % len(_GIT_COLORS)])
+            commits[sha1] = Commit([commits[parent] for parent in shas[1:] if parent in commits],
+                                   message, branch=branch, sha1=sha1)
+        for branch, tip in zip(branches, tips):
+            branch.reset(commits[tip])
+        return repository
+
+    def place(self, log=None):
+        """ Lay out the history and return the Layout.
+
+        A commit goes one column past its parents and what it replaces, then is
+        pulled right up to its nearest child. Runs of commits in dfs_visit
+        order take the top most free lane, obsoleted history below. The layout
+        is kept, and carried on when only new commits were made. log gets every
+        placement written to it.
+        """
+        self._read_all()
+        with self._layout_lock:
+            layout = self._layout
+            if layout is None or self._dirty:
+                self._layout = layout = self._place()
+        if log is not None:
+            for commit in layout.commits:
+                print("Placing %s at %s,%s" % ((commit.sha1,) + layout.position(commit)), file=log)
+        return layout
+
+    def _place(self):
+        dirty, self._dirty = self._dirty, {}
+        reshaped, self._reshaped = self._reshaped, False
+        old = self._layout
+        if old is not None and old._placement is not None and not reshaped:
+            layout = self._place_more(old, dirty)
+            if layout is not None:
+                return layout
+        return self._place_all(dirty)
+
+    def _place_all(self, dirty):
+        self._children = None
+        phases = self._phases("place")
+        size = self._ids.count
+        branches = list(self._branches.values())
+
+        # Walk the active history first, a branch at a time, collecting the
+        # obsoleted history to walk after it. Together that is exactly
+        # dfs_visit's order. Anything left over is only reachable through
+        # replaces pointers and is obsolete as well. Runs are kept as the
+        # index of their first commit, sections as the index after the last
+        # commit each branch's walk came to.
+        seen = set()
+        obsolete = collections.deque()
+        replaced = collections.deque()
+        ends = []
+        def walk():
+            for branch in branches:
+                for commit in _dfs_walk([branch], seen, True, True, False,
+                                        ancestors=obsolete):
+                    yield commit
+                ends.append(len(commits))
+            # The obsoleted history starts here.
+            yield None
+            for commit in _dfs_walk(obsolete, seen, True, True, False):
+                yield commit
+            while replaced:
+                for commit in _dfs_walk(replaced.popleft(), seen, True, True, False):
+                    yield commit
+
+        commits = []
+        runs = []
+        segments = array.array("i", [_UNPLACED]) * size
+        sequence = array.array("i", [0]) * size
+        first_obsolete = None
         last_commit = None
-        for commit in self.dfs_visit(visit_ancestors=True):
-            if not commit.parents:
-                commit.y = lane
+        for commit in walk():
+            if commit is None:
+                first_obsolete = len(runs)
+                active = len(commits)
+                last_commit = None
+                continue
+            # Start a new run if this is a new branch
+            if last_commit is not None and last_commit in commit.parents:
+                new_run = commit.color != commit.parents[0].color
             else:
-                # Advance the lane if this is a new branch
+                new_run = True
+            if new_run:
+                runs.append(len(commits))
+            segments[commit._id] = len(ends) if first_obsolete is None else _OBSOLETE
+            sequence[commit._id] = len(commits)
+            commits.append(commit)
+            replaced.extend(commit.replaces)
+            last_commit = commit
+        runs.append(len(commits))
+
+        phases.lap("walk")
+        asap = self._columns(commits, size)
+        phases.lap("columns")
+        xs = array.array("i", [0]) * size
+        last_column = 0
+        for commit in commits:
+            xs[commit.id] = x = asap[commit.id]
+            last_column = max(last_column, x)
+
+        # pull is the nearest column of a commit's children, bound also
+        # counts the commits replacing it. Only the former pulls it along.
+        # Zero means no children yet. Going by first columns, highest first,
+        # settles every commit after all its children. Both are kept for
+        # the next layout to carry on from.
+        by_column = [[] for _ in range(last_column + 1)]
+        for commit in commits:
+            by_column[xs[commit.id]].append(commit)
+        pull = array.array("i", [0]) * size
+        bound = array.array("i", [0]) * size
+        for column in reversed(by_column):
+            for commit in column:
+                x = xs[commit.id]
+                target = pull[commit.id]
+                if target:
+                    target = min(target, bound[commit.id]) - 1
+                    if target > x:
+                        xs[commit.id] = x = target
                 for parent in commit.parents:
-                    if parent == last_commit:
-                        if commit.color != commit.parents[0].color:
-                            lane += 1
-                        break
+                    if not pull[parent.id] or pull[parent.id] > x:
+                        pull[parent.id] = x
+                for parent in itertools.chain(commit.parents, commit.replaces):
+                    if not bound[parent.id] or bound[parent.id] > x:
+                        bound[parent.id] = x
+        del by_column
+        phases.lap("compaction")
+
+        ys = array.array("i", [0]) * size
+        lanes = []
+        active_lanes = _Lanes(first=1)
+        obsolete_lanes = None
+        for run in range(len(runs) - 1):
+            if run == first_obsolete:
+                obsolete_lanes = _Lanes(first=active_lanes.count + 1)
+            start, end = runs[run], runs[run + 1]
+            lane = (obsolete_lanes or active_lanes).take(
+                xs[commits[start].id], xs[commits[end - 1].id])
+            lanes.append(lane)
+            for commit in commits[start:end]:
+                ys[commit.id] = lane
+        if obsolete_lanes is None:
+            obsolete_lanes = _Lanes(first=active_lanes.count + 1)
+
+        phases.lap("lanes")
+        width = max(xs) if size else 0
+        height = obsolete_lanes.count + active_lanes.count
+        base = self._layout._serial if self._layout is not None else 0
+        placement = _Placement(tuple((b.name, b._head) for b in branches), ends, segments,
+                               sequence, len(commits), runs, lanes, pull, bound)
+        return Layout(commits, xs, ys, width, height, base, dirty, active,
+                      placement=placement)
+
+    def _place_more(self, old, dirty):
+        """ Lay out the history again from old, the layout before, or None.
+
+        Works when commits were only made on top of branches since, at a cost
+        that follows them rather than the size of the history. Otherwise None.
+        """
+        placement = old._placement
+        heads = placement.heads
+        ends = placement.ends
+        branches = list(self._branches.values())
+        if len(branches) < len(heads):
+            return None
+        phases = self._phases("place")
+        old_size = len(old._xs)
+        size = self._ids.count
+
+        blocks = []
+        walked = set()
+        for section, branch in enumerate(branches):
+            head = branch._head
+            if section < len(heads):
+                name, old_head = heads[section]
+                if name != branch.name:
+                    return None
+                if head is old_head:
+                    continue
+                at = ends[section]
+                own = old_head if at > (ends[section - 1] if section else 0) else None
+            else:
+                # New branches come after all of the old ones.
+                at = old._active
+                own = None
+            block = _new_section(head, section, own, old_size, placement.segments, walked)
+            if block is None:
+                return None
+            if block:
+                blocks.append((section, at, block))
+
+        commits = old._commits
+        new = []
+        pieces = []
+        taken = 0
+        for section, at, block in blocks:
+            pieces.append(commits[taken:at])
+            pieces.append(block)
+            new.extend(block)
+            taken = at
+        pieces.append(commits[taken:])
+        order = tuple(itertools.chain.from_iterable(pieces))
+        active = old._active + len(new)
+
+        added = dict((section, len(block)) for section, at, block in blocks)
+        new_ends = []
+        count = 0
+        for section in range(len(branches)):
+            count += added.get(section, 0)
+            end = ends[section] if section < len(ends) else old._active
+            new_ends.append(end + count)
+
+        grow = size - old_size
+        segments = array.array("i", placement.segments)
+        segments.extend(array.array("i", [_UNPLACED]) * grow)
+        sequence = array.array("i", placement.sequence)
+        sequence.extend(array.array("i", [0]) * grow)
+        next_sequence = placement.next_sequence
+        for section, at, block in blocks:
+            for commit in block:
+                segments[commit._id] = section
+                sequence[commit._id] = next_sequence
+                next_sequence += 1
+        phases.lap("walk")
+
+        asap = self._columns(new, size)
+        phases.lap("columns")
+
+        # Compact the new commits, then go down from them by first column,
+        # children before parents, as far as anything moves. A commit moving
+        # left can only pull its parents further left, so that is folded in.
+        # Moving right, which a commit getting its first child can, its
+        # parents' pull and bound are worked out again from their children.
+        xs = array.array("i", old._xs)
+        xs.extend(array.array("i", [0]) * grow)
+        pull = array.array("i", placement.pull)
+        pull.extend(array.array("i", [0]) * grow)
+        bound = array.array("i", placement.bound)
+        bound.extend(array.array("i", [0]) * grow)
+        children = self._children_in(old, False)
+        if children is not None:
+            _add_children(children, new)
+        moved = {}
+        pending = [(-asap[commit._id], commit._id, commit) for commit in new]
+        heapq.heapify(pending)
+        queued = set(commit._id for commit in new)
+        again = set()
+        while pending:
+            _, i, commit = heapq.heappop(pending)
+            if i in again:
+                if children is None:
+                    children = self._children_in(old)
+                    _add_children(children, new)
+                below = [(xs[child._id], commit in child._parents)
+                         for child in children.get(i, ())]
+                pull[i] = min([x for x, parent in below if parent] or [0])
+                bound[i] = min([x for x, parent in below] or [0])
+            x = asap[i]
+            target = pull[i]
+            if target:
+                target = min(target, bound[i]) - 1
+                if target > x:
+                    x = target
+            was = xs[i]
+            if i < old_size:
+                if x == was:
+                    continue
+                moved[i] = commit
+            xs[i] = x
+            for parent in commit._parents:
+                j = parent._id
+                if not pull[j] or pull[j] > x:
+                    pull[j] = x
+            for parent in itertools.chain(commit._parents, commit._replaces):
+                j = parent._id
+                if not bound[j] or bound[j] > x:
+                    bound[j] = x
+                if was and x > was:
+                    again.add(j)
+                if j not in queued:
+                    queued.add(j)
+                    heapq.heappush(pending, (-asap[j], j, parent))
+        width = max([old._width] + [xs[commit._id] for commit in new])
+        if any(old._xs[i] == old._width for i in moved):
+            width = max(xs)
+        phases.lap("compaction")
+
+        # The runs: the old ones moved along, cut where new commits went in,
+        # and the new commits' own.
+        ats = []
+        shifts = []
+        inserted = 0
+        starts = set()
+        for section, at, block in blocks:
+            first = at + inserted
+            for j in range(first, first + len(block)):
+                commit = order[j]
+                last_commit = order[j - 1] if j else None
+                if last_commit is not None and last_commit in commit.parents:
+                    if commit.color != commit.parents[0].color:
+                        starts.add(j)
                 else:
-                    lane += 1
-                commit.y = lane
-            last_commit = commit
-
-        # Now with the branches
-        for commit in self.dfs_visit(visit_ancestors=True, visit_replaces=True):
-            if not commit.parents:
-                commit.x = 1
+                    starts.add(j)
+            inserted += len(block)
+            after = at + inserted
+            if after < len(order) and order[after]._id < old_size:
+                starts.add(after)
+            ats.append(at)
+            shifts.append(inserted)
+        old_runs = placement.runs
+        for start in itertools.islice(old_runs, len(old_runs) - 1):
+            shift = bisect.bisect_right(ats, start)
+            starts.add(start + shifts[shift - 1] if shift else start)
+        runs = sorted(starts)
+        runs.append(len(order))
+        first_obsolete = bisect.bisect_left(runs, active)
+
+        # Runs that are still what they were, in the same lane, stay put.
+        kept = dict((commits[start]._id, (commits[end - 1]._id, lane)) for start, end, lane
+                    in zip(old_runs, itertools.islice(old_runs, 1, None), placement.lanes))
+        ys = array.array("i", old._ys)
+        ys.extend(array.array("i", [0]) * grow)
+        lanes = []
+        active_lanes = _Lanes(first=1)
+        obsolete_lanes = None
+        for run in range(len(runs) - 1):
+            if run == first_obsolete:
+                obsolete_lanes = _Lanes(first=active_lanes.count + 1)
+            start, end = runs[run], runs[run + 1]
+            first, last = order[start], order[end - 1]
+            lane = (obsolete_lanes or active_lanes).take(xs[first._id], xs[last._id])
+            lanes.append(lane)
+            if kept.get(first._id) == (last._id, lane):
+                continue
+            for commit in order[start:end]:
+                i = commit._id
+                if ys[i] != lane:
+                    ys[i] = lane
+                    if i < old_size:
+                        moved[i] = commit
+        if obsolete_lanes is None:
+            obsolete_lanes = _Lanes(first=active_lanes.count + 1)
+
+        phases.lap("lanes")
+        height = obsolete_lanes.count + active_lanes.count
+        placement = _Placement(tuple((b.name, b._head) for b in branches), new_ends,
+                               segments, sequence, next_sequence, runs, lanes, pull, bound)
+        layout = Layout(order, xs, ys, width, height, old._serial, dirty, active, moved,
+                        placement)
+        if children is not None:
+            self._children = (layout._serial, children)
+        return layout
+
+    def _children_in(self, layout, build=True):
+        """ The children of the commits of layout, by id.
+
+        Children here are the commits with a commit as a parent or among
+        the ones they replace. They are kept for the last layout and carried
+        on along with it. If they aren't kept for layout they are worked out
+        again, or it's None if build isn't set.
+        """
+        children = self._children
+        if children is not None and children[0] == layout._serial:
+            return children[1]
+        if not build:
+            return None
+        children = {}
+        _add_children(children, layout.commits)
+        self._children = (layout._serial, children)
+        return children
+
+    def _columns(self, commits, size):
+        """ The first column each of commits could go in, by commit id.
+
+        That is one past the furthest of its parents and the commits it
+        replaces. Columns are worked out on demand and kept, so only new
+        commits cost anything.
+        """
+        asap = self._asap
+        if self._asap_shared:
+            self._asap = asap = array.array("i", asap)
+            self._asap_shared = False
+        if len(asap) < size:
+            asap.extend(array.array("i", [0]) * (size - len(asap)))
+        for commit in commits:
+            stack = [commit]
+            while stack:
+                commit = stack[-1]
+                if asap[commit.id]:
+                    stack.pop()
+                    continue
+                if not commit.parents:
+                    asap[commit.id] = 1
+                    stack.pop()
+                    continue
+                before = list(itertools.chain(commit.parents, commit.replaces))
+                missing = [c for c in before if not asap[c.id]]
+                if missing:
+                    stack.extend(missing)
+                else:
+                    asap[commit.id] = 1 + max(asap[c.id] for c in before)
+                    stack.pop()
+        return asap
+
+    # Each element is written from a template. The attribute order is the
+    # order this has always been written in, so the output doesn't change.
+    SVG_START = ('<svg style="vector-effect: non-scaling-stroke;"'
+                 ' xmlns="http://www.w3.org/2000/svg"'
+                 ' xmlns:svg="http://www.w3.org/2000/svg"'
+                 ' height="%s" width="%s" stroke="null">')
+    REPLACES_PATH = ('<path d="%s" stroke="%s" stroke-dasharray="5, 5"'
+                     ' stroke-width="8" id="%s-%s" fill="none"/>')
+    PARENT_PATH = '<path stroke="%s" stroke-width="8" fill="none" id="%s-%s" d="%s"/>'
+    COMMIT_CIRCLE = ('<circle stroke-linejoin="null" cy="%s" cx="%s"'
+                     ' stroke-dasharray="null" stroke-width="0" r="12"'
+                     ' stroke-linecap="null" id="commit-%s" stroke="#aaaaaa"'
+                     ' fill="%s"><title>%s %s</title></circle>')
+
+    @staticmethod
+    def _edge(px, py, x, y):
+        middle = 60 * (py + y) // 2
+        return "M%s,%s C%s,%s %s,%s %s,%s" % (60 * px, 60 * py,
+                                              60 * x, middle,
+                                              60 * px, middle,
+                                              60 * x, 60 * y)
+
+    # Compact mode puts the shared styling in a stylesheet, one class per
+    # colour, and draws every commit with the same marker from <defs>.
+    COMPACT_START = ('<svg xmlns="http://www.w3.org/2000/svg"'
+                     ' xmlns:xlink="http://www.w3.org/1999/xlink"'
+                     ' height="%s" width="%s">'
+                     '<style>path{stroke-width:8;fill:none;'
+                     'vector-effect:non-scaling-stroke}.r{stroke-dasharray:5,5}'
+                     '%s</style><defs><circle id="c" r="12"/></defs>')
+    COMPACT_PATH = '<path class="%s" d="%s"/>'
+    COMPACT_COMMIT = ('<use xlink:href="#c" x="%s" y="%s" class="f%s">'
+                      '<title>%s %s</title></use>')
+
+    @staticmethod
+    def _compact_edge(px, py, x, y):
+        if py == y:
+            return "M%s,%sH%s" % (60 * px, 60 * py, 60 * x)
+        return Repository._edge(px, py, x, y)
+
+    def render(self, active_branches=None, out=None, compact=False, compress=False,
+               layout=None, viewport=None, executor=None):
+        """ Write the history as svg to out, stdout by default.
+
+        compact moves shared styling into a stylesheet, and compress gzips it
+        for a binary out. A layout from place can be reused, a Viewport draws a
+        window, an executor draws in parallel, and whole renders are looked up
+        in the render_cache first.
+        """
+        if out is None:
+            out = sys.stdout
+        if compress:
+            out = _binary(out)
+        cache = self._render_cache
+        if cache is not None and layout is None and viewport is None:
+            key = self._render_key(active_branches, compact, compress)
+            data = cache.get(key)
+            if self._stats is not None:
+                self._stats.count("render.cache_hits" if data is not None
+                                  else "render.cache_misses")
+            if data is None:
+                rendered = io.BytesIO()
+                self._render(active_branches, rendered, compact, compress, None, None, executor)
+                data = rendered.getvalue()
+                cache.put(key, data)
+            out.write(data if _is_binary(out) else _native(data))
+            return
+        self._render(active_branches, out, compact, compress, layout, viewport, executor)
+
+    def _render(self, active_branches, out, compact, compress, layout, viewport, executor):
+        if compress:
+            out = gzip.GzipFile(fileobj=out, mode="wb", mtime=0)
+        phases = self._phases("render")
+        if layout is None:
+            layout = self.place()
+        phases.lap("place")
+        writer = XmlWriter(out)
+
+        active = self._active(layout, active_branches)
+        phases.lap("active")
+        drawing = self._drawing(compact, layout, active)
+        if viewport is None:
+            writer.write(drawing.start % (60 * (layout.height + 1), 60 * (layout.width + 1)))
+            drawn = self._draw(writer, drawing.fragments, layout, active, drawing,
+                               executor=executor, phases=phases)
+            self._keep_fragments(drawing.mode, _Fragments(
+                layout, drawing.key, active, drawn[0], drawn[1], drawing.extra))
+        else:
+            # Only part of it gets drawn, so the cached fragments stay as they
+            # were for the next render.
+            window = viewport.window(layout)
+            writer.write(self._window_start(drawing.start, window))
+            self._draw(writer, drawing.fragments, layout, active, drawing,
+                       viewport.select(layout), executor=executor, phases=phases)
+            if drawing.fragments is not None:
+                self._keep_fragments(drawing.mode, drawing.fragments)
+        if drawing.extra:
+            writer.write("<style>%s</style>" % self._style(drawing.extra))
+        writer.end("svg")
+        writer.flush()
+        if compress:
+            out.close()
+        phases.lap("flush")
+
+    def render_file(self, path, active_branches=None, compact=False, layout=None,
+                    viewport=None, executor=None):
+        """ Render to the file at path, gzipped if it ends with .svgz """
+        with open(path, "wb") as out:
+            self.render(active_branches=active_branches,
+                        out=out,
+                        compact=compact,
+                        compress=path.endswith(".svgz"),
+                        layout=layout,
+                        viewport=viewport,
+                        executor=executor)
+
+    def render_tiles(self, directory, columns=32, lanes=16, active_branches=None,
+                     compact=False, layout=None, executor=None):
+        """ Render the history as tiles of columns by lanes, one svg file each.
+
+        Tiles go to directory as <row>-<column>.svg. Returns the paths, a list
+        per row. An executor is used as for render.
+        """
+        if layout is None:
+            layout = self.place()
+        active = self._active(layout, active_branches)
+        drawing = self._drawing(compact, layout, active)
+        edges, circles = self._draw(None, drawing.fragments, layout, active, drawing,
+                                    executor=executor)
+        self._keep_fragments(drawing.mode, _Fragments(
+            layout, drawing.key, active, edges, circles, drawing.extra))
+
+        rows = max(1, -(-layout.height // lanes))
+        cols = max(1, -(-layout.width // columns))
+        tiles = [[([], []) for col in range(cols)] for row in range(rows)]
+        position = layout.position
+        for commit in layout.commits:
+            x, y = position(commit)
+            for row in _tiles(y, y, lanes, rows):
+                for col in _tiles(x, x, columns, cols):
+                    tiles[row][col][1].append(circles[commit.id])
+            if not edges[commit.id]:
+                continue
+            ends = [position(p) for p in itertools.chain(commit.parents, commit.replaces)]
+            first_x = min(px for px, py in ends)
+            first_y = min(y, min(py for px, py in ends))
+            last_y = max(y, max(py for px, py in ends))
+            for row in _tiles(first_y, last_y, lanes, rows):
+                for col in _tiles(first_x, x, columns, cols):
+                    tiles[row][col][0].append(edges[commit.id])
+
+        end = "<style>%s</style>" % self._style(drawing.extra) if drawing.extra else ""
+        paths = []
+        for row, tile_row in enumerate(tiles):
+            paths.append([])
+            for col, (tile_edges, tile_circles) in enumerate(tile_row):
+                window = (col * columns + 1, (col + 1) * columns,
+                          row * lanes + 1, (row + 1) * lanes)
+                path = os.path.join(directory, "%d-%d.svg" % (row, col))
+                with open(path, "wb") as out:
+                    writer = XmlWriter(out)
+                    writer.write(self._window_start(drawing.start, window))
+                    for text in itertools.chain(tile_edges, tile_circles):
+                        writer.write(text)
+                    writer.write(end)
+                    writer.end("svg")
+                    writer.flush()
+                paths[-1].append(path)
+        return paths
+
+    @staticmethod
+    def _window_start(start, window):
+        # The elements are drawn where they would be in the whole picture
+        # and a viewBox picks out the window, with the same margin of a
+        # column and a lane that the whole picture has.
+        first_x, last_x, first_y, last_y = window
+        width = 60 * (last_x - first_x + 2)
+        height = 60 * (last_y - first_y + 2)
+        return ('<svg viewBox="%s %s %s %s"' % (60 * (first_x - 1), 60 * (first_y - 1),
+                                                 width, height)
+                + (start % (height, width))[len("<svg"):])
+
+    def _active(self, layout, active_branches):
+        """ Which commits of layout are active, as a flag per commit id. """
+        active = bytearray(self._ids.count)
+        if not active_branches and layout is self._layout and not self._dirty:
+            # Placing it already split off the active history.
+            for commit in layout.commits[:layout._active]:
+                active[commit._id] = 1
+            return active
+        if not active_branches:
+            active_branches = list(self._branches.values())
+        if self._reachability is not None:
+            is_active = ReachabilityIndex.contains(
+                self._reachability.reachable(active_branches))
+        else:
+            is_active = {c for c in dfs_visit(active_branches)}.__contains__
+        for commit in layout.commits:
+            if is_active(commit):
+                active[commit.id] = 1
+        return active
+
+    def _take_fragments(self, mode, key):
+        # Taking them out keeps concurrent renders off each other's
+        # fragments. Whichever loses just draws everything.
+        with self._fragments_lock:
+            fragments = self._fragments.pop(mode, None)
+        if fragments is not None and fragments.key != key:
+            return None
+        return fragments
+
+    def _keep_fragments(self, mode, fragments):
+        with self._fragments_lock:
+            self._fragments[mode] = fragments
+
+    @staticmethod
+    def _changed(fragments, layout, active):
+        """ The ids of the commits drawn differently than in fragments.
+
+        None means nothing can be reused: there are no fragments, or they
+        weren't drawn from this layout or the one it replaced.
+        """
+        if fragments is None:
+            return None
+        old = fragments.layout
+        if old is layout:
+            changed = set()
+        elif old._serial == layout._base:
+            changed = set(layout._touched)
+            if layout._moved is not None:
+                changed.update(layout._moved)
             else:
-                minimum_x = max(p.x + 1 for p in itertools.chain(commit.parents,commit.replaces))
-                # Take the next spot in the same lane
-                commit.x = minimum_x
-            grid[commit.y][commit.x] = commit
-            print("Placing %s at %s,%s" % (commit.sha1, commit.x, commit.y), file=sys.stderr)
-            for parent in commit.parents:
-                parent.max_x = min(commit.x-1, parent.max_x)
-            # Try to pull parents closer if possible
-            # TODO Do this recursively?
-            for parent in commit.parents:
-                if not any(grid[parent.y][x] for x in range(parent.x+1, commit.x)):
-                    parent.x = min(commit.x-1, parent.max_x)
-
-        return grid
-
-    def render(self, active_branches=None):
-        xml = XmlDoc()
-        grid = self.place()
-        with xml.root(name='svg') as svg:
-            height = len(grid)
-            width = max(max(x for x in lane) for lane in grid.values())
-            svg.attrs = {
-                "height": str(60 * (height + 1)),
-                "width": str(60 * (width + 1)),
-                "xmlns": "http://www.w3.org/2000/svg",
-                "xmlns:svg": "http://www.w3.org/2000/svg",
-                "stroke": "null",
-                "style": "vector-effect: non-scaling-stroke;",
-            }
-            if not active_branches:
-                active_branches = self._branches.values()
-            active = {c for c in dfs_visit(active_branches)}
-
-            for commit in self.dfs_visit(visit_ancestors=True):
-                for parent in commit.replaces:
-                    with svg.child("path") as line:
-                        line.attrs = {
-                            "id": "%s-%s" % (parent.sha1, commit.sha1),
-                            "stroke": parent.color.lighten() if parent not in active else parent.color,
-                            "d": "M%s,%s C%s,%s %s,%s %s,%s" % (60 * parent.x, 60 * parent.y,
-                                                                60 * commit.x, 60 * (parent.y + commit.y)/2,
-                                                                60 * parent.x, 60 * (parent.y + commit.y)/2,
-                                                                60 * commit.x, 60 * commit.y),
-                            "stroke-width": "8",
-                            "stroke-dasharray": "5, 5",
-                            "fill": "none",
-                        }
-                for parent in commit.parents:
-                    with svg.child("path") as line:
-                        line.attrs = {
-                            "id": "%s-%s" % (parent.sha1, commit.sha1),
-                            "stroke": parent.color.lighten() if commit not in active else parent.color,
-                            "d": "M%s,%s C%s,%s %s,%s %s,%s" % (60 * parent.x, 60 * parent.y,
-                                                                60 * commit.x, 60 * (parent.y + commit.y)/2,
-                                                                60 * parent.x, 60 * (parent.y + commit.y)/2,
-                                                                60 * commit.x, 60 * commit.y),
-                            "stroke-width": "8",
-                            "fill": "none",
-                        }
-
-            for commit in self.dfs_visit(visit_ancestors=True):
-                with svg.child("circle") as circle:
-                    circle.attrs = {
-                        "id": "commit-" + commit.sha1,
-                        "cy": str(60 * commit.y),
-                        "cx": str(60 * commit.x),
-                        "fill": commit.color.lighten() if commit not in active else commit.color,
-                        "stroke": "#aaaaaa",
-                        "r": "12",
-                        "stroke-linecap": "null",
-                        "stroke-linejoin": "null",
-                        "stroke-dasharray": "null",
-                        "stroke-width": "0",
-                    }
-                    with circle.child("title") as title:
-                        with title.text() as text:
-                            text.content = "%s %s" % (commit.sha1[0:6], commit.message)
-
-        xml.render()
+                for commit in layout.commits:
+                    if commit not in old or old.position(commit) != layout.position(commit):
+                        changed.add(commit.id)
+        else:
+            return None
+        # Commits made since count as changed, whether they're laid out or not.
+        old_active = fragments.active
+        count = len(old_active)
+        if old_active != active[:count]:
+            changed.update(i for i, (was, now) in enumerate(zip(old_active, active))
+                           if was != now)
+        changed.update(range(count, len(active)))
+        return changed
+
+    @staticmethod
+    def _draw(writer, fragments, layout, active, drawing, shown=None, executor=None,
+              phases=NO_PHASES):
+        """ Write the edges into every commit, then every commit.
+
+        Commits keep their fragments from the last render unless touched, moved
+        or changed between active and not. Returns the fragments drawn, and
+        with no writer only draws them. shown narrows down what is drawn.
+        """
+        changed = Repository._changed(fragments, layout, active)
+        edge_commits, circle_commits = shown or (layout.commits, layout.commits)
+        drawn_edges = {}
+        drawn_circles = {}
+        if (changed is None and shown is None and executor is None
+                and numpy is not None and len(layout.commits) >= _VECTORIZE):
+            drawn = _draw_vectorized(drawing, layout, active)
+            if drawn is not None:
+                drawn_edges, drawn_circles = drawn
+                phases.lap("draw")
+                if writer is not None:
+                    writer.write("".join([drawn_edges[c._id] for c in layout.commits]))
+                    writer.write("".join([drawn_circles[c._id] for c in layout.commits]))
+                phases.lap("write")
+                return drawn_edges, drawn_circles
+
+        if changed is None:
+            edges_to_draw = list(edge_commits)
+            circles_to_draw = list(circle_commits)
+        else:
+            edges_to_draw = []
+            circles_to_draw = []
+            for commit in edge_commits:
+                text = None
+                if not (commit._id in changed
+                        or any(p._id in changed for p in commit._parents)
+                        or any(p._id in changed for p in commit._replaces)):
+                    text = fragments.edges.get(commit._id)
+                if text is None:
+                    edges_to_draw.append(commit)
+                else:
+                    drawn_edges[commit._id] = text
+            for commit in circle_commits:
+                text = None
+                if commit._id not in changed:
+                    text = fragments.circles.get(commit._id)
+                if text is None:
+                    circles_to_draw.append(commit)
+                else:
+                    drawn_circles[commit._id] = text
+
+        # Edges first, so colour classes are handed out in drawing order.
+        edge_records = [drawing.edge_record(c) for c in edges_to_draw]
+        circle_records = [drawing.circle_record(c) for c in circles_to_draw]
+        for commits, records, kind, drawn in (
+                (edges_to_draw, edge_records, "edges", drawn_edges),
+                (circles_to_draw, circle_records, "circles", drawn_circles)):
+            if executor is None or len(records) <= _CHUNK:
+                texts = _format(drawing.mode, kind, records)
+            else:
+                chunks = [records[i:i + _CHUNK] for i in range(0, len(records), _CHUNK)]
+                texts = itertools.chain.from_iterable(executor.map(
+                    _format, itertools.repeat(drawing.mode), itertools.repeat(kind), chunks))
+            for commit, text in zip(commits, texts):
+                drawn[commit._id] = text
+        phases.lap("draw")
+
+        if writer is not None:
+            for commit in edge_commits:
+                writer.write(drawn_edges[commit._id])
+            for commit in circle_commits:
+                writer.write(drawn_circles[commit._id])
+        phases.lap("write")
+        return drawn_edges, drawn_circles
+
+    def _drawing(self, compact, layout, active, cached=True):
+        """ Get ready to draw layout in one mode or the other.
+
+        Takes the cached fragments for the mode, if they are any use and
+        cached is set, and returns them with the start of the svg, a
+        template for its height and width, and the functions making the
+        records of a commit's edges and circle for _format.
+        """
+        if not compact:
+            fragments = self._take_fragments("plain", None) if cached else None
+            edge_record, circle_record = self._plain_records(layout, active)
+            return _Drawing("plain", None, fragments, self.SVG_START,
+                            edge_record, circle_record, None, None)
+
+        # Number every colour in use, normal and lightened, for the classes.
+        palette = collections.OrderedDict()
+        for branch in self._branches.values():
+            palette.setdefault(str(branch.color), len(palette))
+            palette.setdefault(str(branch.color.lighten()), len(palette))
+
+        # Fragments name colour classes, so they only carry over while the
+        # palette stays the same.
+        key = tuple(palette)
+        fragments = self._take_fragments("compact", key) if cached else None
+
+        # Colours that weren't a branch's get their own stylesheet at the end.
+        # Their classes are kept along with the fragments using them.
+        extra = fragments.extra if fragments is not None else collections.OrderedDict()
+        edge_record, circle_record = self._compact_records(layout, active, palette, extra)
+        start = self.COMPACT_START % ("%s", "%s", self._style(palette))
+        return _Drawing("compact", key, fragments, start, edge_record, circle_record,
+                        palette, extra)
+
+    @staticmethod
+    def _style(palette):
+        return "".join(".s%s{stroke:%s}.f%s{fill:%s}" % (i, c, i, c)
+                       for c, i in palette.items())
+
+    @staticmethod
+    def _plain_records(layout, active):
+        """ The functions making the records of a commit's edges and circle.
+
+        An edge is (replaces, px, py, x, y, colour, parent sha1, sha1) and a
+        circle (x, y, sha1, colour, message). These run once per commit
+        drawn and can't be farmed out, so they go straight to the arrays.
+        """
+        xs, ys = layout._xs, layout._ys
+
+        def edge_record(commit):
+            i = commit._id
+            x, y = xs[i], ys[i]
+            sha1 = commit.sha1
+            edges = []
+            for parent in commit._replaces:
+                p = parent._id
+                color = parent._color if active[p] else parent._color.lighten()
+                edges.append((True, xs[p], ys[p], x, y, color._string, parent.sha1, sha1))
+            lit = active[i]
+            for parent in commit._parents:
+                p = parent._id
+                color = parent._color if lit else parent._color.lighten()
+                edges.append((False, xs[p], ys[p], x, y, color._string, parent.sha1, sha1))
+            return edges
+
+        def circle_record(commit):
+            i = commit._id
+            color = commit._color if active[i] else commit._color.lighten()
+            return xs[i], ys[i], commit.sha1, color._string, commit._message
+
+        return edge_record, circle_record
+
+    @staticmethod
+    def _compact_records(layout, active, palette, extra):
+        """ The same, with the number of the colour's class for the colour. """
+        def color_class(color):
+            color = color._string
+            index = palette.get(color)
+            if index is None:
+                index = extra.get(color)
+                if index is None:
+                    index = extra[color] = len(palette) + len(extra)
+            return index
+
+        xs, ys = layout._xs, layout._ys
+        def edge_record(commit):
+            i = commit._id
+            x, y = xs[i], ys[i]
+            edges = []
+            for parent in commit._replaces:
+                p = parent._id
+                color = parent._color if active[p] else parent._color.lighten()
+                edges.append((True, xs[p], ys[p], x, y, color_class(color), None, None))
+            lit = active[i]
+            for parent in commit._parents:
+                p = parent._id
+                color = parent._color if lit else parent._color.lighten()
+                edges.append((False, xs[p], ys[p], x, y, color_class(color), None, None))
+            return edges
+
+        def circle_record(commit):
+            i = commit._id
+            color = commit._color if active[i] else commit._color.lighten()
+            return xs[i], ys[i], commit.sha1, color_class(color), commit._message
+
+        return edge_record, circle_record
 
     def dfs_visit(self, visit_parents=True, visit_ancestors=True, visit_replaces=False):
-        return dfs_visit(self._branches.values(),
+        self._read_all()
+        return dfs_visit(list(self._branches.values()),
                          visit_parents=visit_parents,
                          visit_ancestors=visit_ancestors,
                          visit_replaces=visit_replaces)
+
+    def merge_base(self, one, two):
+        return merge_base(one, two)
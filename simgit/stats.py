@@ -0,0 +1,129 @@
+from __future__ import print_function
+
+import collections
+import contextlib
+import cProfile
+import pstats
+import sys
+import time
+
+# The best clock there is for timing short things.
+clock = getattr(time, "perf_counter", time.time)
+
+
+class Stats(object):
+    """ Counters and timings from a repository, see Repository.stats.
+
+    Counters are named like dfs_visit.commits or commits.replay and timings
+    like branch.replay or place.lanes, each adding up calls and seconds.
+    Hooks are called as hook(kind, name, value) as things are recorded:
+    kind is "count" with the amount added, or "time" with the seconds.
+    """
+    def __init__(self):
+        self._counters = collections.Counter()
+        self._timings = collections.OrderedDict()
+        self._hooks = []
+
+    @property
+    def counters(self):
+        return self._counters
+
+    @property
+    def timings(self):
+        """ name -> [calls, seconds] """
+        return self._timings
+
+    def add_hook(self, hook):
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def count(self, name, amount=1):
+        self._counters[name] += amount
+        for hook in self._hooks:
+            hook("count", name, amount)
+
+    def time(self, name, seconds):
+        timing = self._timings.get(name)
+        if timing is None:
+            timing = self._timings[name] = [0, 0.0]
+        timing[0] += 1
+        timing[1] += seconds
+        for hook in self._hooks:
+            hook("time", name, seconds)
+
+    def counted(self, name, iterable):
+        """ Pass iterable through, counting a call and the items under name. """
+        items = 0
+        try:
+            for item in iterable:
+                items += 1
+                yield item
+        finally:
+            self.count(name + ".calls")
+            self.count(name + ".commits", items)
+
+    def phases(self, prefix):
+        """ Time the phases of something, ended one by one with lap(name). """
+        return _Phases(self, prefix)
+
+    def reset(self):
+        self._counters.clear()
+        self._timings.clear()
+
+    def as_dict(self):
+        return collections.OrderedDict([
+            ("counters", collections.OrderedDict(sorted(self._counters.items()))),
+            ("timings", collections.OrderedDict(
+                (name, collections.OrderedDict([("calls", calls), ("seconds", seconds)]))
+                for name, (calls, seconds) in self._timings.items())),
+        ])
+
+    def report(self, out=None):
+        """ Print the counters and timings as a table, slowest first. """
+        if out is None:
+            out = sys.stderr
+        for name, (calls, seconds) in sorted(self._timings.items(),
+                                             key=lambda item: -item[1][1]):
+            print("%-32s %8d calls %10.4fs" % (name, calls, seconds), file=out)
+        for name, value in sorted(self._counters.items()):
+            print("%-32s %8d" % (name, value), file=out)
+
+
+class _Phases(object):
+    def __init__(self, stats, prefix):
+        self._stats = stats
+        self._prefix = prefix
+        self._last = clock()
+
+    def lap(self, name):
+        now = clock()
+        self._stats.time("%s.%s" % (self._prefix, name), now - self._last)
+        self._last = now
+
+
+class _NoPhases(object):
+    # Stands in for _Phases when there are no stats, so timing costs a call.
+    def lap(self, name):
+        pass
+
+
+NO_PHASES = _NoPhases()
+
+
+@contextlib.contextmanager
+def profile(out=None, top=20, sort="cumulative"):
+    """ Run the body under cProfile and print the top hot paths after.
+
+    The profile goes to out, stderr by default, sorted by sort as for
+    pstats. The cProfile.Profile is given to the body to keep if wanted.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        stats = pstats.Stats(profiler, stream=out or sys.stderr)
+        stats.sort_stats(sort).print_stats(top)
@@ -0,0 +1,266 @@
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from simgit import bench
+from simgit import repository
+
+
+def play(ops, state=None, start=0):
+    """Run (operation, branch, other) steps against a new repository.
+
+    Branches are given by their index in order of creation and every step
+    names its messages after its own position, so a failing history can be
+    pasted here from a fuzzing run as it is. Steps that would take a branch
+    onto itself, or fix up a root commit, do nothing. Given the repository
+    and branches of an earlier play as state, and the number of steps it
+    took as start, the steps go on from there instead.
+    """
+    if state is None:
+        repo = repository.Repository()
+        master = repo.branch("master", color="#808080")
+        master.commit("init")
+        state = repo, [master]
+    repo, branches = state
+    for i, (op, b, o) in enumerate(ops, start):
+        b, o = branches[b], branches[o]
+        if o is b and op in ("merge", "rebase", "replay", "squash"):
+            continue
+        if op == "commit":
+            b.commit("c%d" % i)
+        elif op == "branch":
+            branches.append(b.branch("b%d" % i, color="#00%02x80" % i))
+        elif op == "amend":
+            b.replay_amend()
+        elif op == "merge":
+            b.merge(o)
+        elif op == "rebase":
+            b.rebase(o)
+        elif op == "replay":
+            b.replay(o)
+        elif op == "squash":
+            b.replay_squash(o, "s%d" % i)
+        elif op == "fixup":
+            head = b.head
+            if not head.parents:
+                continue
+            fixup = b.commit("fix%d" % i)
+            b.fixup_replay(head, {fixup: head})
+        else:
+            raise Exception("Unknown operation %s" % op)
+    return repo, branches
+
+
+_STEPS = ["commit", "commit", "branch", "amend", "merge", "rebase",
+          "replay", "squash", "fixup"]
+
+
+def random_ops(rng, count, branches=1):
+    """count steps for play, picked with rng, for that many branches to
+    start with. Returns them and the number of branches at the end.
+    """
+    ops = []
+    for _ in range(count):
+        op = rng.choice(_STEPS)
+        ops.append((op, rng.randrange(branches), rng.randrange(branches)))
+        if op == "branch":
+            branches += 1
+    return ops, branches
+
+
+def histories(count, steps):
+    """Yield (seed, ops) for count random histories of that many steps
+    that play through, whose state can be hashed.
+
+    Some random histories are refused by replay, or loop through replaces
+    and ancestors, which these tests aren't about.
+    """
+    for seed in range(count):
+        ops = random_ops(random.Random(seed), steps)[0]
+        try:
+            play(ops)[0].state_hash
+        except Exception:
+            continue
+        yield seed, ops
+
+
+def recursive_dfs_visit(branches, visit_parents, visit_ancestors, visit_replaces):
+    """dfs_visit as it was first written, with a generator per commit."""
+    seen = set()
+
+    def visit(commit):
+        if commit.sha1 in seen:
+            return
+        seen.add(commit.sha1)
+        if visit_ancestors:
+            branches.extend(commit.ancestors)
+        parents = []
+        if visit_parents:
+            parents += sorted(commit.parents, key=lambda c: c.branch_num)
+        if visit_replaces:
+            parents += commit.replaces
+        for parent in parents:
+            for child in visit(parent):
+                yield child
+        yield commit
+
+    while branches:
+        branch = branches.pop(0)
+        for commit in visit(branch.commitish()):
+            yield commit
+
+
+class WalkTest(unittest.TestCase):
+    def test_dfs_visit_matches_recursive_walk(self):
+        for seed, ops in histories(60, 40):
+            repo = play(ops)[0]
+            for flags in [(True, False, False), (True, True, False),
+                          (False, False, True), (True, True, True)]:
+                self.assertEqual(
+                    [c.sha1 for c in recursive_dfs_visit(
+                        list(repo.branches.values()), *flags)],
+                    [c.sha1 for c in repo.dfs_visit(*flags)],
+                    "seed %d %r" % (seed, flags))
+
+
+class PlaceTest(unittest.TestCase):
+    def assertSameLayout(self, layout, full, note):
+        self.assertEqual(full.commits, layout.commits, note)
+        self.assertEqual((full.width, full.height),
+                         (layout.width, layout.height), note)
+        for c in full.commits:
+            self.assertEqual(full.position(c), layout.position(c), note)
+
+    def test_incremental_matches_full(self):
+        for seed, ops in histories(40, 30):
+            state = play([])
+            state[0].place()
+            for i, op in enumerate(ops):
+                play([op], state, i)
+                repo = state[0]
+                self.assertSameLayout(repo.place(), repo._place_all({}),
+                                      "seed %d step %d" % (seed, i))
+
+    def test_commits_on_top(self):
+        seed, ops = next(histories(10, 20))
+        repo, branches = play(ops)
+        rng = random.Random(seed)
+        repo.place()
+        for n in range(50):
+            branch = rng.choice(branches)
+            if rng.random() < 0.2:
+                branches.append(branch.branch("t%d" % n, color="#7f00%02x" % n))
+            else:
+                branch.commit_many(["t%d.%d" % (n, k)
+                                    for k in range(rng.randint(1, 3))])
+            self.assertSameLayout(repo.place(), repo._place_all({}),
+                                  "step %d" % n)
+
+
+class ReplayTest(unittest.TestCase):
+    def test_replay_after_fixup_and_amend(self):
+        repo, (master, b0) = play([
+            ("branch", 0, 0), ("amend", 0, 0), ("merge", 0, 1),
+            ("rebase", 1, 0), ("commit", 0, 0), ("fixup", 1, 0),
+            ("commit", 0, 0), ("amend", 1, 0), ("merge", 0, 1),
+            ("replay", 1, 0)])
+        self.assertTrue(repository.is_ancestor(master.head, b0.head))
+
+    def test_squash_replaces_revisions_on_both_sides(self):
+        repo, branches = play([
+            ("replay", 0, 0), ("amend", 0, 0), ("commit", 0, 0),
+            ("commit", 0, 0), ("amend", 0, 0), ("replay", 0, 0),
+            ("commit", 0, 0), ("replay", 0, 0), ("fixup", 0, 0),
+            ("branch", 0, 0), ("squash", 1, 0), ("squash", 1, 1),
+            ("commit", 0, 1), ("fixup", 1, 1), ("replay", 0, 1),
+            ("amend", 1, 1), ("merge", 1, 0), ("branch", 1, 0),
+            ("merge", 0, 0), ("fixup", 2, 1), ("replay", 2, 2),
+            ("branch", 1, 1), ("amend", 2, 0), ("branch", 3, 1),
+            ("amend", 2, 1), ("commit", 3, 4), ("squash", 3, 1),
+            ("branch", 2, 3), ("squash", 0, 3)])
+        squashed = branches[0].head
+        self.assertEqual("s28", squashed.message)
+        self.assertEqual(["s10", "Merging ['master'] into b9", "s26"],
+                         [c.message for c in squashed.replaces])
+
+
+class ForkTest(unittest.TestCase):
+    def test_rebase_in_place(self):
+        repo, (master, b0) = play([("branch", 0, 0)])
+        fork = repo.fork()
+        rebased = fork.branches["b0"].rebase(fork.branches["master"])
+        self.assertIsNot(master.head, rebased)
+        self.assertEqual([rebased], list(rebased.ancestors))
+        self.assertEqual([], list(master.head.ancestors))
+
+    def test_fork_matches_rebuild(self):
+        for seed, ops in histories(150, 30):
+            repo, branches = play(ops[:15])
+            fork = repo.fork()
+            play(ops[15:], (fork, [fork.branches[b.name] for b in branches]), 15)
+            self.assertEqual(play(ops)[0].state_hash, fork.state_hash,
+                             "seed %d" % seed)
+            self.assertEqual(play(ops[:15])[0].state_hash, repo.state_hash,
+                             "seed %d" % seed)
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def round_trip(self, repo):
+        path = os.path.join(self.directory, "snapshot")
+        repo.save(path)
+        return repository.Repository.load(path)
+
+    def test_round_trip(self):
+        for seed, ops in histories(60, 40):
+            repo = play(ops)[0]
+            loaded = self.round_trip(repo)
+            self.assertEqual(repo.state_hash, loaded.state_hash, "seed %d" % seed)
+            self.assertEqual([c.sha1 for c in repo.dfs_visit(True, True, True)],
+                             [c.sha1 for c in loaded.dfs_visit(True, True, True)],
+                             "seed %d" % seed)
+
+    def test_load_reads_as_it_goes(self):
+        repo = repository.Repository()
+        master = repo.branch("master", color="#808080")
+        master.commit_many(["c%d" % n for n in range(1000)])
+        topic = master.branch("topic", color="#007fff")
+        topic.commit("t")
+        topic.replay_amend()
+        loaded = self.round_trip(repo)
+        head = loaded.branches["topic"].head
+        self.assertEqual("c999", head.parents[0].message)
+        self.assertEqual(2, len(loaded._change_of(head).revisions))
+        self.assertEqual(1001, loaded._unread)
+        self.assertEqual(repo.state_hash, loaded.state_hash)
+        self.assertEqual(0, loaded._unread)
+
+
+class BenchTest(unittest.TestCase):
+    def test_generate_is_replayable(self):
+        for seed in range(10):
+            repo = bench.generate(commits=300, branches=8, rounds=5, seed=seed)
+            self.assertTrue(repo.ids.count >= 300)
+
+    def test_generate_is_repeatable(self):
+        first = bench.generate(commits=300, branches=8, rounds=5, seed=1)
+        second = bench.generate(commits=300, branches=8, rounds=5, seed=1)
+        self.assertEqual([c.message for c in first.dfs_visit()],
+                         [c.message for c in second.dfs_visit()])
+
+    def test_run(self):
+        results = bench.run(commits=200, branches=4, rounds=3, memory=False)
+        self.assertEqual(results["history"]["commits"],
+                         results["history"]["placed"])
+
+
+if __name__ == "__main__":
+    unittest.main()